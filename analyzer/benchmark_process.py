@@ -0,0 +1,100 @@
+"""
+Micro-benchmark for the timestamp handling in process.py.
+
+Compares the vectorized Process.process_timestamps and
+Process_drukte.init_drukte_df with the former list comprehension
+implementations, on a synthetic gvb-like table.
+
+Usage: python benchmark_process.py [--rows N]
+"""
+
+import argparse
+import datetime
+import logging
+import timeit
+
+import numpy as np
+import pandas as pd
+
+import process
+from main import vollcodes_m2_land
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+
+def gvb_like_table(rows):
+    """Create a gvb-like table with random quarter hour timestamps."""
+    start = np.datetime64('2017-12-04T00:00')
+    quarters = np.random.randint(0, 7 * 24 * 4, size=rows)
+    return pd.DataFrame({
+        'halte': np.random.choice(['Centraal Station', 'Dam', 'Spui'], rows),
+        'incoming': np.random.randint(0, 500, size=rows),
+        'timestamp': start + quarters * np.timedelta64(15, 'm'),
+    })
+
+
+def old_process_timestamps(data):
+    data['timestamp'] = data.timestamp.dt.round('60min')
+    data['weekday'] = [ts.weekday() for ts in data.timestamp]
+    data['hour'] = [ts.hour for ts in data.timestamp]
+
+
+def new_process_timestamps(data):
+    x = process.Process.__new__(process.Process)
+    x.data = data
+    x.process_timestamps()
+
+
+def old_init_drukte_df(start_datetime, end_datetime, vollcodes):
+    timestamps = pd.date_range(
+        start=start_datetime, end=end_datetime, freq='H')
+    ts_vc = [(ts, vc) for ts in timestamps for vc in vollcodes]
+    df = pd.DataFrame({
+        'timestamp': [x[0] for x in ts_vc],
+        'vollcode': [x[1] for x in ts_vc]
+    }).sort_values(['timestamp', 'vollcode'])
+    df['weekday'] = [ts.weekday() for ts in df.timestamp]
+    df['hour'] = [ts.hour for ts in df.timestamp]
+    return df
+
+
+def new_init_drukte_df(start_datetime, end_datetime, vollcodes):
+    x = process.Process_drukte.__new__(process.Process_drukte)
+    return x.init_drukte_df(start_datetime, end_datetime, vollcodes)
+
+
+def compare(name, old, new, setup, number):
+    old_time = min(timeit.repeat(
+        lambda: old(*setup()), repeat=3, number=number))
+    new_time = min(timeit.repeat(
+        lambda: new(*setup()), repeat=3, number=number))
+    log.info(
+        '%s: old %.3fs new %.3fs speedup %.1fx',
+        name, old_time, new_time, old_time / new_time)
+
+
+def main(rows):
+    gvb = gvb_like_table(rows)
+    compare(
+        f'process_timestamps ({rows} rows)',
+        old_process_timestamps, new_process_timestamps,
+        lambda: (gvb.copy(),), number=1)
+
+    start = datetime.datetime(2018, 2, 12, 0, 0)
+    end = datetime.datetime(2018, 2, 18, 23, 0)
+    vollcodes = list(vollcodes_m2_land.keys())
+    compare(
+        'init_drukte_df',
+        old_init_drukte_df, new_init_drukte_df,
+        lambda: (start, end, vollcodes), number=10)
+
+
+if __name__ == '__main__':
+    desc = "Benchmark timestamp processing."
+    parser = argparse.ArgumentParser(desc)
+    parser.add_argument(
+        '--rows', type=int, default=2000000,
+        help='number of rows in the synthetic gvb table')
+    args = parser.parse_args()
+    main(args.rows)
@@ -1,30 +1,15 @@
-import configparser
-from sqlalchemy import create_engine
-from sqlalchemy.engine.url import URL
-
 import pandas as pd
 import logging
 
-config_auth = configparser.RawConfigParser()
-config_auth.read('auth.conf')
+import database
 
 logging.basicConfig(level=logging.DEBUG)
 log = logging.getLogger(__name__)
 
 
 def get_conn():
-    """Create a connection to the database."""
-    dbconfig = 'docker'
-    postgres_url = URL(
-        drivername='postgresql',
-        username=config_auth.get(dbconfig, 'user'),
-        password=config_auth.get(dbconfig, 'password'),
-        host=config_auth.get(dbconfig, 'host'),
-        port=config_auth.get(dbconfig, 'port'),
-        database=config_auth.get(dbconfig, 'dbname')
-    )
-    conn = create_engine(postgres_url)
-    return conn
+    """Return the shared analyzer engine."""
+    return database.get_engine('docker')
 
 
 def main():
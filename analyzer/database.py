@@ -0,0 +1,170 @@
+"""
+Database connections for the analyzer.
+
+All analyzer modules get their SQLAlchemy engine from get_engine, so every
+process shares one connection pool per database config instead of creating
+a new engine for each dataset.
+
+The pool is configured with environment variables:
+
+ANALYZER_DB_POOL_SIZE          - connections kept in the pool (default 5)
+ANALYZER_DB_STATEMENT_TIMEOUT  - statement timeout in ms (default 0, no limit)
+
+The number of opened connections and the time spent connecting and running
+queries are counted in STATS, see log_stats. STATS is per process: worker
+processes return the counts of their work (stats_since) and the parent adds
+them to its own with add_stats.
+"""
+
+import configparser
+import io
+import logging
+import os
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy import event
+from sqlalchemy import text
+from sqlalchemy.engine.url import URL
+
+config_auth = configparser.RawConfigParser()
+config_auth.read('auth.conf')
+
+log = logging.getLogger(__name__)
+
+POOL_SIZE = int(os.getenv('ANALYZER_DB_POOL_SIZE', 5))
+STATEMENT_TIMEOUT = int(os.getenv('ANALYZER_DB_STATEMENT_TIMEOUT', 0))
+
+STATS = {
+    'connections': 0,
+    'connect_seconds': 0.0,
+    'queries': 0,
+    'query_seconds': 0.0,
+}
+
+# Engines per (process id, dbconfig). Worker processes must not use the
+# pooled connections they inherit from their parent.
+_engines = {}
+
+
+def make_engine(dbconfig):
+    """Create an instrumented, pooled engine for a config in auth.conf."""
+    postgres_url = URL(
+        drivername='postgresql',
+        host=config_auth.get(dbconfig, 'host'),
+        port=config_auth.get(dbconfig, 'port'),
+        database=config_auth.get(dbconfig, 'dbname'),
+        username=config_auth.get(dbconfig, 'user'),
+        password=config_auth.get(dbconfig, 'password')
+    )
+    engine = create_engine(
+        postgres_url,
+        pool_size=POOL_SIZE,
+        pool_pre_ping=True,
+        connect_args={
+            'options': f'-c statement_timeout={STATEMENT_TIMEOUT}'},
+    )
+    instrument(engine)
+    return engine
+
+
+def get_engine(dbconfig):
+    """Return the shared engine for dbconfig, creating it on first use."""
+    key = (os.getpid(), dbconfig)
+    if key not in _engines:
+        _engines[key] = make_engine(dbconfig)
+    return _engines[key]
+
+
+def instrument(engine):
+    """Count connections and time spent connecting and querying."""
+
+    @event.listens_for(engine, 'do_connect')
+    def before_connect(dialect, conn_rec, cargs, cparams):
+        conn_rec.info['connect_start'] = time.time()
+
+    @event.listens_for(engine, 'connect')
+    def after_connect(dbapi_connection, conn_rec):
+        STATS['connections'] += 1
+        STATS['connect_seconds'] += \
+            time.time() - conn_rec.info.pop('connect_start', time.time())
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_execute(conn, cursor, statement, params, context, many):
+        conn.info.setdefault('query_start', []).append(time.time())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_execute(conn, cursor, statement, params, context, many):
+        STATS['queries'] += 1
+        STATS['query_seconds'] += time.time() - conn.info['query_start'].pop()
+
+
+def stats_since(before):
+    """The STATS counted since the copy before was taken."""
+    return {key: STATS[key] - before[key] for key in STATS}
+
+
+def add_stats(stats):
+    """Add the STATS of a worker process to the STATS of this process."""
+    for key, value in stats.items():
+        STATS[key] += value
+
+
+def log_stats(name='', stats=None):
+    """Log the connection and query statistics, by default of STATS."""
+    stats = stats or STATS
+    log.info(
+        '%s database: %d connections opened (%.2fs), %d queries (%.2fs)',
+        name, stats['connections'], stats['connect_seconds'],
+        stats['queries'], stats['query_seconds'])
+
+
+def write_table(engine, dataframe, table_name, primary_key='index'):
+    """Replace a table with the data of a dataframe.
+
+    The dataframe (including its index) is streamed with COPY into a staging
+    table, which gets its primary key and then replaces table_name. This all
+    happens in one transaction, so readers never see a partial table.
+    """
+    staging = f'{table_name}_staging'
+    data = dataframe.reset_index()
+    columns = ', '.join(f'"{c}"' for c in data.columns)
+
+    buffer = io.StringIO()
+    data.to_csv(buffer, header=False, index=False)
+    buffer.seek(0)
+
+    start = time.time()
+    with engine.begin() as conn:
+        # Create the empty staging table with the schema of the dataframe.
+        data.head(0).to_sql(
+            staging, con=conn, index=False, if_exists='replace')
+
+        with conn.connection.cursor() as cursor:
+            cursor.copy_expert(
+                f'COPY "{staging}" ({columns}) FROM STDIN WITH (FORMAT csv)',
+                buffer)
+
+        conn.execute(f"""
+        ALTER TABLE "{staging}" ADD PRIMARY KEY ("{primary_key}");
+        DROP TABLE IF EXISTS "{table_name}";
+        ALTER TABLE "{staging}" RENAME TO "{table_name}";
+        ALTER TABLE "{table_name}"
+            RENAME CONSTRAINT "{staging}_pkey" TO "{table_name}_pkey";
+        """)
+
+    log.debug(
+        'wrote %d rows to "%s" in %.2fs',
+        len(data), table_name, time.time() - start)
+
+
+def write_drukteindex_version(conn, table_name):
+    """Record that the analyzer (re)filled an API drukteindex table.
+
+    The API uses this marker to invalidate its cached responses.
+    """
+    conn.execute(text("""
+    INSERT INTO datasets_drukteindexversion (table_name, updated_at)
+    VALUES (:table_name, now())
+    ON CONFLICT (table_name) DO UPDATE SET updated_at = EXCLUDED.updated_at;
+    """), table_name=table_name)
@@ -2,33 +2,19 @@
 This module computes the drukteindex values for ~40 hand-picked hotspots.
 """
 
-import configparser
 import logging
-from sqlalchemy import create_engine
-from sqlalchemy.engine.url import URL
 import pandas as pd
 import numpy as np
 
-config_auth = configparser.RawConfigParser()
-config_auth.read('auth.conf')
+import database
 
 logging.basicConfig(level=logging.DEBUG)
 log = logging.getLogger(__name__)
 
 
 def get_conn():
-    """Create a connection to the database."""
-    dbconfig = 'docker'
-    postgres_url = URL(
-        drivername='postgresql',
-        username=config_auth.get(dbconfig, 'user'),
-        password=config_auth.get(dbconfig, 'password'),
-        host=config_auth.get(dbconfig, 'host'),
-        port=config_auth.get(dbconfig, 'port'),
-        database=config_auth.get(dbconfig, 'dbname')
-    )
-    conn = create_engine(postgres_url)
-    return conn
+    """Return the shared analyzer engine."""
+    return database.get_engine('docker')
 
 
 def linear_model(drukte):
@@ -90,7 +76,12 @@ def fill_hotspot_tables(conn=None):
 
     if not conn:
         conn = get_conn()
-    conn.execute(insert_into_models_hotspots)
+
+    # Replace the api data and its version marker in one transaction.
+    with conn.begin() as transaction:
+        transaction.execute(insert_into_models_hotspots)
+        database.write_drukteindex_version(
+            transaction, 'datasets_hotspotsdrukteindex')
     log.debug('done.')
 
 
@@ -185,10 +176,10 @@ def main():
 
     log.debug('Writing to db..')
 
-    drukteindex_hotspots.to_sql(
-        name='drukteindex_hotspots', con=conn, if_exists='replace')
+    database.write_table(conn, drukteindex_hotspots, 'drukteindex_hotspots')
 
     fill_hotspot_tables(conn=conn)
+    database.log_stats('hotspots')
 
 
 if __name__ == '__main__':
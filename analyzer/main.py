@@ -18,6 +18,7 @@ import argparse
 import logging
 import numpy as np
 
+import database
 import process
 
 config_auth = configparser.RawConfigParser()
@@ -232,12 +233,10 @@ def write_table_to_db(dataframe, table_name):
     """
     log.debug('creating or replacing table \"%s\".' % table_name)
     dbconfig = args.dbConfig[0]
-    connection = process.connect_database(dbconfig)
+    connection = database.get_engine(dbconfig)
 
     # Write dataframe data to table
-    dataframe.to_sql(
-        name=table_name, con=connection, index=True, if_exists='replace')
-    connection.execute(f'ALTER TABLE "{table_name}" ADD PRIMARY KEY ("index")')
+    database.write_table(connection, dataframe, table_name)
 
     log.debug('done.')
 
@@ -283,7 +282,7 @@ def fill_table_in_db(org_table_name, fill_table_name, columns):
     # """
 
     dbconfig = args.dbConfig[0]
-    connection = process.connect_database(dbconfig)
+    connection = database.get_engine(dbconfig)
     # datasets_buurtcombinatiedrukteindex
     insert_into_api_table = """
     TRUNCATE TABLE "datasets_buurtcombinatiedrukteindex";
@@ -305,7 +304,10 @@ def fill_table_in_db(org_table_name, fill_table_name, columns):
     WHERE b."vollcode" = c."vollcode";
     """
 
-    connection.execute(insert_into_api_table)
+    # Replace the api data and its version marker in one transaction.
+    with connection.begin() as transaction:
+        transaction.execute(insert_into_api_table)
+        database.write_drukteindex_version(transaction, fill_table_name)
 
     log.debug('done.')
 
@@ -315,7 +317,7 @@ def run():
     # dbconfig is the same for all datasources now.
     # Could be different in the future.
     dbconfig = args.dbConfig[0]
-    drukte = process.Process_drukte(dbconfig)
+    drukte = process.Process_drukte(dbconfig, workers=args.workers)
     # Still use older linear model for now
     pipeline_on = False
 
@@ -353,6 +355,8 @@ def run():
         'datasets_buurtcombinatiedrukteindex',
         ['index', 'ogc_fid', 'hour', 'weekday', 'drukteindex'])
 
+    database.log_stats('analyzer')
+
 
 if __name__ == "__main__":
     """Run the analyzer."""
@@ -363,5 +367,9 @@ if __name__ == "__main__":
         'dbConfig', type=str,
         help='database config settings: dev or docker',
         nargs=1)
+    parser.add_argument(
+        '--workers', type=int, default=None,
+        help='number of processes loading the data sources '
+             '(default: one per cpu, 1: no worker processes)')
     args = parser.parse_args()
     run()
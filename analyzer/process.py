@@ -7,18 +7,17 @@ For each dataset, a subclass of class 'Process'
 is created to load and pre-process this dataset.
 """
 
-import configparser
 import logging
 import datetime
+import os
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
+from sqlalchemy import inspect as sa_inspect
 from main import vollcodes_m2_land
 
-from sqlalchemy import create_engine
-from sqlalchemy.engine.url import URL
-
-config_auth = configparser.RawConfigParser()
-config_auth.read('auth.conf')
+import database
 
 logging.basicConfig(level=logging.DEBUG)
 log = logging.getLogger(__name__)
@@ -31,20 +30,50 @@ log = logging.getLogger(__name__)
 # temp.import_data(['verblijversindex'], ['vollcode', 'oppervlakte_land_m2'])
 # vollcodes_m2_land = dict(zip(list(temp.data.vollcode), list(temp.data.oppervlakte_land_m2)))
 
+# Number of rows fetched per chunk when importing a table.
+CHUNKSIZE = 100000
+
+# Dtypes columns are downcast to while importing.
+CATEGORY_COLUMNS = ['vollcode', 'halte', 'stadsdeelcode', 'hotspot']
+INT8_COLUMNS = ['weekday', 'hour']
+FLOAT32_COLUMNS = [
+    'lat', 'lon', 'occupancy', 'occupancy_times_vakken',
+    'expected', 'main_category_weight']
+
 ##############################################################################
 # Helper Functions
 
-def connect_database(dbconfig):
-    """Create a sqlachemy connection with a database."""
-    postgres_url = URL(
-        drivername='postgresql',
-        host=config_auth.get(dbconfig, 'host'),
-        port=config_auth.get(dbconfig, 'port'),
-        database=config_auth.get(dbconfig, 'dbname'),
-        username=config_auth.get(dbconfig, 'user'),
-        password=config_auth.get(dbconfig, 'password')
-    )
-    return create_engine(postgres_url)
+
+def downcast(df):
+    """Downcast known columns to smaller dtypes."""
+    for col in df.columns.intersection(CATEGORY_COLUMNS):
+        df[col] = df[col].astype('category')
+    for col in df.columns.intersection(INT8_COLUMNS):
+        # Integer columns can not hold missing values.
+        if df[col].notnull().all():
+            df[col] = df[col].astype('int8')
+    for col in df.columns.intersection(FLOAT32_COLUMNS):
+        df[col] = df[col].astype('float32')
+    return df
+
+
+def concat_frames(frames):
+    """Concatenate dataframes, keeping categorical columns categorical.
+
+    pd.concat falls back to object columns when the categories differ,
+    so the categories are unified first.
+    """
+    frames = list(frames)
+    if not frames:
+        return pd.DataFrame()
+
+    for col in frames[0].select_dtypes(['category']).columns:
+        categories = union_categoricals(
+            [frame[col] for frame in frames]).categories
+        for frame in frames:
+            frame[col] = frame[col].cat.set_categories(categories)
+
+    return pd.concat(frames, ignore_index=True)
 
 
 def norm(x):
@@ -63,42 +92,49 @@ class Process():
         self.name = ''                          # Name of datasource
         self.data = pd.DataFrame()              # Data of datasource
         self.patterns = pd.DataFrame()          # Patterns of datasource
-        # Database connection of datasource
-        self.conn = connect_database(dbconfig)
+        # Database connection of datasource (shared pool)
+        self.conn = database.get_engine(dbconfig)
 
     def __str__(self):
         """Print string representation of Process"""
         return "Dataset name: %s\nData: %s" % (self.name, self.data)
 
-    def import_data(self, tables, columns):
-        """Create Pandas dataframe."""
-        d = dict.fromkeys(tables)
-        for table in tables:
-            # Import each table as dataframe
-            d[table] = self.import_table(table)
-            if columns == []:
-                pass
-            else:
-                # Only select relevant columns
-                d[table] = d[table][columns]
-        # Combine dataframes
-        self.data = pd.concat([v for v in d.values()])
-        del d
+    def import_data(self, tables, columns, where=None, params=None):
+        """Create Pandas dataframe.
+
+        Only the given columns (all columns if empty) and the rows matching
+        the optional sql where clause are read from the database.
+        """
+        self.data = concat_frames(
+            self.import_table(table, columns, where, params)
+            for table in tables)
         self.process_timestamps()
 
-    def import_table(self, table):
+    def import_table(self, table, columns=None, where=None, params=None):
         """Import one table from the database
-        one datasource could be split up into multiple tables."""
-        sql_query = """ SELECT * FROM "{}" """  # Standard format sql query
-        table_data = pd.read_sql(sql=sql_query.format(table), con=self.conn)
-        return table_data
+        one datasource could be split up into multiple tables.
+
+        The table is streamed in chunks through a server side cursor
+        and each chunk is downcast before the next one is read.
+        """
+        select = ', '.join(f'"{col}"' for col in columns) if columns else '*'
+        sql_query = f'SELECT {select} FROM "{table}"'
+        if where:
+            sql_query += f' WHERE {where}'
+
+        chunks = pd.read_sql(
+            sql=sql_query, params=params, chunksize=CHUNKSIZE,
+            con=self.conn.execution_options(stream_results=True))
+
+        return concat_frames(downcast(chunk) for chunk in chunks)
 
     def process_timestamps(self):
         """Create weekday and hour columns when a timestamp column exists"""
         if 'timestamp' in self.data.columns:
-            self.data['timestamp'] = self.data.timestamp.dt.round('60min')
-            self.data['weekday'] = [ts.weekday() for ts in self.data.timestamp]
-            self.data['hour'] = [ts.hour for ts in self.data.timestamp]
+            timestamps = self.data.timestamp.dt.round('60min')
+            self.data['timestamp'] = timestamps
+            self.data['weekday'] = timestamps.dt.weekday.astype('int8')
+            self.data['hour'] = timestamps.dt.hour.astype('int8')
 
     def dataset_specific(self):
         """To be implemented by child classes"""
@@ -203,54 +239,74 @@ class Process():
         pass
 
 
-class Process_gvb_stad(Process):
-    """GVB datasource."""
+def metro_or_train_haltes():
+    """Haltes of metro and train stations."""
+    df = pd.read_csv('lookup_tables/metro_or_train.csv', sep=',')
+    return tuple(df['station'])
+
+
+class Process_gvb(Process):
+    """GVB datasource, shared by the city and buurt level processes.
+
+    The table is read once, the processes split the metro and train
+    haltes from the other haltes in pandas.
+    """
 
     def __init__(self, dbconfig):
         super().__init__(dbconfig)
-        self.name = 'gvb_stad'
+        self.name = 'gvb'
         self.import_data(
             ['gvb'],
-            ['halte', 'incoming', 'timestamp', 'lat', 'lon', 'vollcode'])
+            ['halte', 'incoming', 'timestamp', 'vollcode'])
+
+
+class Process_gvb_stad(Process):
+    """GVB datasource.
+
+    Uses the data of the given Process_gvb, or reads it when not given.
+    """
+
+    def __init__(self, dbconfig, gvb=None):
+        super().__init__(dbconfig)
+        self.name = 'gvb_stad'
+        if gvb is None:
+            gvb = Process_gvb(dbconfig)
+        # Only the metro and train stations are used on city level.
+        indx = gvb.data.halte.isin(metro_or_train_haltes())
+        self.data = gvb.data.loc[indx, :]
         self.dataset_specific()
         self.rename({'incoming': 'gvb_stad'})
         # self.normalize_acreage_city('gvb_stad')
 
     def dataset_specific(self):
-        df = pd.read_csv('lookup_tables/metro_or_train.csv', sep=',')
-        stations = df['station']
-        haltes = list(stations)
-        indx = self.data.halte.isin(haltes)
-
         # Stadsniveau (sum of incoming values over all areas)
-        gvb_stad = self.data.loc[indx, :]
-        gvb_stad = gvb_stad.groupby(['weekday', 'hour'])['incoming'].sum()
+        gvb_stad = self.data.groupby(['weekday', 'hour'])['incoming'].sum()
         self.data = gvb_stad.reset_index()
 
 
 class Process_gvb_buurt(Process):
-    """GVB datasource."""
+    """GVB datasource.
 
-    def __init__(self, dbconfig):
+    Uses the data of the given Process_gvb, or reads it when not given.
+    """
+
+    def __init__(self, dbconfig, gvb=None):
         super().__init__(dbconfig)
         self.name = 'gvb_buurt'
-        self.import_data(
-            ['gvb'],
-            ['halte', 'incoming', 'timestamp', 'lat', 'lon', 'vollcode'])
+        if gvb is None:
+            gvb = Process_gvb(dbconfig)
+        # Metro and train stations are only used on city level.
+        indx = gvb.data.halte.isin(metro_or_train_haltes())
+        self.data = gvb.data.loc[np.logical_not(indx), :]
 
         self.dataset_specific()
         self.rename({'incoming': 'gvb_buurt'})
         # self.normalize_acreage('gvb_buurt')
 
     def dataset_specific(self):
-        haltes = list(
-            pd.read_csv(
-                'lookup_tables/metro_or_train.csv', sep=',')['station'])
-        indx = self.data.halte.isin(haltes)
-
         # Buurtniveau
-        gvb_buurt = self.data.loc[np.logical_not(indx), :]
-        gvb_grouped = gvb_buurt.groupby(['vollcode', 'weekday', 'hour'])
+        gvb_grouped = self.data.groupby(
+            ['vollcode', 'weekday', 'hour'], observed=True)
         self.data = gvb_grouped['incoming'].mean().reset_index()
 
 
@@ -284,7 +340,7 @@ class Process_alpha_locations_expected(Process):
         # historical weekpatroon
         # first calculate the average weekpatroon per location
         grouped_google_week_location = self.data.groupby([
-            'weekday', 'hour', aggregation_level, 'name'])
+            'weekday', 'hour', aggregation_level, 'name'], observed=True)
         google_week_location = grouped_google_week_location['expected'].mean()
         google_week_location = google_week_location.reset_index()
 
@@ -294,14 +350,14 @@ class Process_alpha_locations_expected(Process):
         # and then calculate the average weekpatroon per
         # hotspot/vollcode/other aggregation level
         grouped_google_week = google_week_location.groupby(
-            [aggregation_level, 'weekday', 'hour'])
+            [aggregation_level, 'weekday', 'hour'], observed=True)
 
         google_week = grouped_google_week['expected'].mean()
         google_week = google_week.reset_index()
 
         # also calculate the average weekpatroon per stadsdeel
         grouped_week_stads_deel = google_week_location.groupby(
-            ['stadsdeelcode', 'weekday', 'hour'])
+            ['stadsdeelcode', 'weekday', 'hour'], observed=True)
         google_week_stadsdeel = grouped_week_stads_deel['expected'].mean()
         google_week_stadsdeel = google_week_stadsdeel.reset_index()
 
@@ -326,30 +382,72 @@ class Process_alpha_locations_expected(Process):
         self.data = pd.concat([google_week, google_week_stadsdeel])
 
 
-class Process_parkeren(Process):
+def parkeren_weeks():
+    """First and last ISO week (yyyyww) of the parkeren data to use.
 
-    def __init__(self, dbconfig, aggregation_level):
-        super().__init__(dbconfig)
-        self.name = 'parkeren'
-        self.import_data(['parkeren'],
-                         ['id', 'index', 'occupancy', 'vakken', 'weekday', 'hour',
-                          'occupancy_times_vakken', 'vollcode'])
-        self.dataset_specific(aggregation_level)
+    Read from ANALYZER_PARKEREN_WEEKS, e.g. "201808-201817".
+    Returns None (all weeks) when it is not set.
+    """
+    weeks = os.getenv('ANALYZER_PARKEREN_WEEKS')
+    if not weeks:
+        return None
+    first, last = weeks.split('-')
+    return int(first), int(last)
 
-    def dataset_specific(self, aggregation_level):
-        df = self.data
 
-        # Create a df containing the number of parking spots for every vollcode
-        vakken_per_vollcode = df.drop_duplicates('id').groupby(
-            'vollcode')['vakken'].sum().to_frame().reset_index()
+class Process_parkeren(Process):
+    """Week patterns of parking occupancy per vollcode.
+
+    The importer writes every week of parking data to its own partition
+    of the parkeren table. The patterns are aggregated in the database,
+    averaged over the weeks in the given (first, last) range.
+    """
 
-        # Calculate week patterns per vollcode.
-        week_patterns = df.groupby(['vollcode', 'weekday', 'hour']).agg(
-            {'occupancy_times_vakken': np.sum}).reset_index()
-        week_patterns = week_patterns.merge(vakken_per_vollcode, on='vollcode')
-        week_patterns['mean_occupancy'] = week_patterns['occupancy_times_vakken'] / week_patterns['vakken']
+    def __init__(self, dbconfig, aggregation_level, weeks=None):
+        super().__init__(dbconfig)
+        self.name = 'parkeren'
+        self.dataset_specific(aggregation_level, weeks or parkeren_weeks())
+
+    def dataset_specific(self, aggregation_level, weeks):
+        # Tables imported before the per week import have no week column,
+        # they hold a single week.
+        columns = sa_inspect(self.conn).get_columns('parkeren')
+        week, order = 'week', ', week'
+        if 'week' not in [c['name'] for c in columns]:
+            week, order = '0', ''
+
+        where = ''
+        params = {}
+        if weeks and week == 'week':
+            where = 'WHERE week BETWEEN %(first)s AND %(last)s'
+            params = {'first': weeks[0], 'last': weeks[1]}
+
+        # Number of parking spots for every vollcode, and the
+        # occupancy per vollcode, weekday and hour averaged over the weeks.
+        sql = f"""
+        WITH vakken_per_vollcode AS (
+            SELECT vollcode, sum(vakken) AS vakken
+            FROM (
+                SELECT DISTINCT ON (id) id, vollcode, vakken
+                FROM parkeren {where}
+                ORDER BY id{order}
+            ) parkeervakken
+            GROUP BY vollcode
+        ), week_patterns AS (
+            SELECT vollcode, weekday, hour,
+                sum(occupancy_times_vakken) / count(DISTINCT {week})
+                    AS occupancy_times_vakken
+            FROM parkeren {where}
+            GROUP BY vollcode, weekday, hour
+        )
+        SELECT p.vollcode, p.weekday, p.hour, p.occupancy_times_vakken,
+            v.vakken,
+            p.occupancy_times_vakken / v.vakken AS mean_occupancy
+        FROM week_patterns p
+        JOIN vakken_per_vollcode v ON v.vollcode = p.vollcode
+        """
 
-        self.data = week_patterns
+        self.data = downcast(pd.read_sql(sql, self.conn, params=params))
 
 
 class Process_verblijversindex(Process):
@@ -388,27 +486,86 @@ class Process_buurtcombinatie(Process):
         self.import_data(['buurtcombinatie'], ['vollcode'])
 
 
+def load_verblijversindex(dbconfig):
+    return {'verblijversindex': Process_verblijversindex(dbconfig).data}
+
+
+def load_gvb(dbconfig):
+    # Read the gvb table once for both aggregation levels.
+    gvb = Process_gvb(dbconfig)
+    return {
+        'gvb_stad': Process_gvb_stad(dbconfig, gvb).data,
+        'gvb_buurt': Process_gvb_buurt(dbconfig, gvb).data,
+    }
+
+
+def load_parkeren(dbconfig):
+    return {'parkeren': Process_parkeren(dbconfig, 'vollcode').data}
+
+
+# Independent source loaders used by Process_drukte.
+# Each returns a dict of source name -> dataframe.
+SOURCE_LOADERS = [load_verblijversindex, load_gvb, load_parkeren]
+
+
+def run_loader(loader, dbconfig):
+    """Run a source loader in a worker process.
+
+    Returns the dataframes and the database STATS of the loader.
+    """
+    before = dict(database.STATS)
+    frames = loader(dbconfig)
+    stats = database.stats_since(before)
+    database.log_stats(loader.__name__, stats)
+    return frames, stats
+
+
+def load_sources(dbconfig, workers=None):
+    """Run all source loaders and return the combined dict of dataframes.
+
+    The loaders run concurrently in a pool of worker processes
+    (one per cpu when workers is None). With workers=1 they run
+    one after another in the current process. The database STATS of
+    the workers are added to the STATS of the current process.
+    """
+    frames = {}
+
+    if workers == 1:
+        for loader in SOURCE_LOADERS:
+            frames.update(loader(dbconfig))
+        return frames
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(run_loader, loader, dbconfig)
+            for loader in SOURCE_LOADERS]
+        for future in futures:
+            loader_frames, stats = future.result()
+            frames.update(loader_frames)
+            database.add_stats(stats)
+
+    return frames
+
+
 class Process_drukte(Process):
     """Implements the drukte process to combine multiple
     datasources for further analysis.
     """
 
-    def __init__(self, dbconfig):
+    def __init__(self, dbconfig, workers=None):
         super().__init__(dbconfig)
         self.name = 'drukte'
 
         # Run import processes of other datasets
         # NOTUSED
         # brt = Process_buurtcombinatie(dbconfig)
-        vbi = Process_verblijversindex(dbconfig)
-        gvb_st = Process_gvb_stad(dbconfig)
-        gvb_bc = Process_gvb_buurt(dbconfig)
         # alp_hist = Process_alpha_historical(dbconfig)
         # alp_live = Process_alpha_live(dbconfig)
         # alp_vollcode = Process_alpha_locations_expected(dbconfig, 'vollcode')
 
         # alp_hotspots = Process_alpha_locations_expected(dbconfig, 'hotspot')
-        parkeren = Process_parkeren(dbconfig, 'vollcode')
+        sources = load_sources(dbconfig, workers)
+
         # initialize drukte dataframe
         # Start of a week: Monday at midnight
         start = datetime.datetime(2018, 2, 12, 0, 0)
@@ -430,19 +587,19 @@ class Process_drukte(Process):
         #     on=['weekday', 'hour', 'vollcode'], how='left')
 
         self.data = pd.merge(
-            self.data, gvb_bc.data,
+            self.data, sources['gvb_buurt'],
             on=['vollcode', 'weekday', 'hour'], how='left')
 
         self.data = pd.merge(
-            self.data, gvb_st.data,
+            self.data, sources['gvb_stad'],
             on=['weekday', 'hour'], how='left')
 
         self.data = pd.merge(
-            self.data, vbi.data,
+            self.data, sources['verblijversindex'],
             on='vollcode', how='left')
 
         self.data = pd.merge(
-            self.data, parkeren.data,
+            self.data, sources['parkeren'],
             on=['weekday', 'hour', 'vollcode'], how='left')
 
         # Init drukte index
@@ -451,20 +608,21 @@ class Process_drukte(Process):
         # Init hotspot dataframe
         # self.hotspots = alp_hotspots
 
-        # Remove timestamps from weekpattern (only day and hour are relevant)
-        self.data.drop('timestamp', axis=1, inplace=True)
-
     def init_drukte_df(self, start_datetime, end_datetime, vollcodes):
         """Creates a dataframe with weekdays,
         hours and vollcodes for a given time period.
+
+        Only day and hour are relevant for the week pattern,
+        so the timestamps themselves are not kept.
         """
         timestamps = pd.date_range(
             start=start_datetime, end=end_datetime, freq='H')
-        ts_vc = [(ts, vc) for ts in timestamps for vc in vollcodes]
+        grid = pd.MultiIndex.from_product(
+            [timestamps, sorted(vollcodes)], names=['timestamp', 'vollcode'])
+        timestamps = grid.get_level_values('timestamp')
         df = pd.DataFrame({
-            'timestamp': [x[0] for x in ts_vc],
-            'vollcode': [x[1] for x in ts_vc]
-        }).sort_values(['timestamp', 'vollcode'])
-        df['weekday'] = [ts.weekday() for ts in df.timestamp]
-        df['hour'] = [ts.hour for ts in df.timestamp]
+            'vollcode': grid.get_level_values('vollcode'),
+            'weekday': timestamps.weekday.astype('int8'),
+            'hour': timestamps.hour.astype('int8'),
+        }, columns=['vollcode', 'weekday', 'hour'])
         return df
@@ -19,6 +19,7 @@ import numpy as np
 import copy
 
 # Import modules to test
+import database
 import process
 
 from main import vollcodes_m2_land
@@ -78,7 +79,8 @@ class testProcess(unittest.TestCase):
         haltes = list(csv['station'])
         indx = x.data.halte.isin(haltes)
         gvb_buurt = x.data.loc[np.logical_not(indx), :]
-        grouped = gvb_buurt.groupby(['vollcode', 'weekday', 'hour'])
+        grouped = gvb_buurt.groupby(
+            ['vollcode', 'weekday', 'hour'], observed=True)
         x.data = grouped['incoming'].mean().reset_index()
 
         opervlakten_buurt = list(vollcodes_m2_land.items())
@@ -99,6 +101,85 @@ class testProcess(unittest.TestCase):
             assert before[col][i] == approx(after[col][i])
 
 
+class testDowncast(unittest.TestCase):
+    """Test the dtypes of imported tables."""
+
+    def test_downcast(self):
+        df = process.downcast(pd.DataFrame({
+            'vollcode': ['A00', 'A01'],
+            'weekday': [0, 6],
+            'hour': [1.0, np.nan],
+            'lat': [52.37, 52.38],
+            'incoming': [10, 20],
+        }))
+
+        assert df.vollcode.dtype == 'category'
+        assert df.weekday.dtype == 'int8'
+        # Missing values can not be int8.
+        assert df.hour.dtype == 'float64'
+        assert df.lat.dtype == 'float32'
+        assert df.incoming.dtype == 'int64'
+
+    def test_concat_frames(self):
+        frames = [
+            process.downcast(pd.DataFrame({'vollcode': ['A00', 'A01']})),
+            process.downcast(pd.DataFrame({'vollcode': ['B00']})),
+        ]
+        df = process.concat_frames(frames)
+
+        assert df.vollcode.dtype == 'category'
+        assert list(df.vollcode) == ['A00', 'A01', 'B00']
+        assert list(df.index) == [0, 1, 2]
+        assert process.concat_frames([]).empty
+
+
+class testDatabase(unittest.TestCase):
+    """Test the database.py module."""
+
+    def test_write_table(self):
+        engine = database.get_engine('test')
+        table = 'test_write_table'
+
+        first = pd.DataFrame(
+            {'vollcode': ['A00', 'A01'], 'drukteindex': [0.5, 1.0]},
+            index=[10, 11])
+        database.write_table(engine, first, table)
+        read = pd.read_sql(f'SELECT * FROM "{table}" ORDER BY index', engine)
+        assert read.to_dict('list') == {
+            'index': [10, 11],
+            'vollcode': ['A00', 'A01'],
+            'drukteindex': [0.5, 1.0],
+        }
+
+        # A second write replaces the table, without a staging table left.
+        second = pd.DataFrame({'vollcode': ['B00'], 'drukteindex': [0.1]})
+        database.write_table(engine, second, table)
+        read = pd.read_sql(f'SELECT * FROM "{table}"', engine)
+        assert read.to_dict('list') == {
+            'index': [0], 'vollcode': ['B00'], 'drukteindex': [0.1]}
+
+        with engine.begin() as conn:
+            staging = conn.execute(
+                "SELECT to_regclass(%s)", (f'{table}_staging',)).scalar()
+            primary_key = conn.execute(
+                "SELECT to_regclass(%s)", (f'{table}_pkey',)).scalar()
+            conn.execute(f'DROP TABLE "{table}"')
+
+        assert staging is None
+        assert primary_key is not None
+
+    def test_stats(self):
+        before = dict(database.STATS)
+        database.STATS['queries'] += 2
+        stats = database.stats_since(before)
+        assert stats['queries'] == 2
+        assert stats['connections'] == 0
+
+        # The stats of a worker process are added to the totals.
+        database.add_stats(stats)
+        assert database.STATS['queries'] == before['queries'] + 4
+
+
 if __name__ == "__main__":
     """Running this script as a stand-alone module should run
     all the tests and complete them without failures."""
@@ -0,0 +1,141 @@
+"""
+Conditional HTTP fetching of realtime feeds.
+
+The feeds we poll (OV-fiets, NDW, parkeergarages) often did not change since
+the last request. ConditionalFetcher remembers the ETag / Last-Modified
+validators and the parsed result of every url and parser. The next request
+sends them as If-None-Match / If-Modified-Since; when the server answers 304
+Not Modified the previously parsed result is returned without downloading or
+parsing the feed again.
+
+The validators and parsed results are kept in memory and, when a cache_file
+is given, in a json file so they survive restarts.
+
+Entries are keyed on the url and the parse function, so two sources reading
+the same url with different parsers never get each other's result.
+
+Large feeds can be parsed while they are downloaded, see parse_ndw_velocity.
+
+The same module lives in importer/http_cache.py for realtime.py and in
+api/citydynamics/datasets/http_cache.py for the api proxy. The two copies
+must stay identical, the test stage of the Jenkinsfile compares them.
+"""
+
+import json
+import logging
+import os
+import threading
+
+import ijson
+import requests
+
+log = logging.getLogger(__name__)
+
+
+def parse_json(response):
+    return response.json()
+
+
+def ndw_velocity_sums(stream):
+    """Sum the velocities per road type of an NDW travel time geojson.
+
+    The features are read one by one from the file-like stream, so memory use
+    does not depend on the size of the feed.
+
+    Returns {road_type: {'sum': total velocity, 'count': number of features}}.
+    """
+    sums = {}
+    for properties in ijson.items(stream, 'features.item.properties'):
+        if 'Velocity' not in properties:
+            continue
+        road_type = sums.setdefault(
+            properties.get('Type'), {'sum': 0.0, 'count': 0})
+        road_type['sum'] += float(properties['Velocity'])
+        road_type['count'] += 1
+    return sums
+
+
+def parse_ndw_velocity(response):
+    """Streaming parser for ConditionalFetcher.get(..., stream=True)."""
+    response.raw.decode_content = True
+    return ndw_velocity_sums(response.raw)
+
+
+def cache_key(url, parse):
+    """Key of the cached entry of url parsed with parse."""
+    return f'{parse.__module__}.{parse.__qualname__} {url}'
+
+
+class ConditionalFetcher(object):
+    """Fetch urls with a validator cache."""
+
+    def __init__(self, session=None, cache_file=None):
+        self.session = session or requests.Session()
+        self.cache_file = cache_file
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        """Load the cache file, if there is one."""
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return
+        try:
+            with open(self.cache_file) as cache_file:
+                self.entries = json.load(cache_file)
+        except (OSError, ValueError):
+            log.exception('Could not read %s, starting empty', self.cache_file)
+
+    def save(self):
+        if not self.cache_file:
+            return
+        tmp_file = f'{self.cache_file}.tmp'
+        with open(tmp_file, 'w') as cache_file:
+            json.dump(self.entries, cache_file)
+        os.replace(tmp_file, self.cache_file)
+
+    def headers(self, key):
+        """Request headers with the validators of the cached entry of key."""
+        headers = {'Accept-Encoding': 'gzip'}
+        entry = self.entries.get(key)
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def get(self, url, parse=parse_json, timeout=None, **kwargs):
+        """Return parse(response) of url, or the cached result on a 304.
+
+        parse must return something json serializable when a cache_file
+        is used. Raises requests.HTTPError on other error responses.
+        """
+        key = cache_key(url, parse)
+        headers = self.headers(key)
+        headers.update(kwargs.pop('headers', {}))
+
+        response = self.session.get(
+            url, headers=headers, timeout=timeout, **kwargs)
+
+        # Release the connection also when the body was streamed.
+        with response:
+            if response.status_code == 304 and key in self.entries:
+                log.debug('Not modified: %s', url)
+                return self.entries[key]['data']
+
+            response.raise_for_status()
+            data = parse(response)
+
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if etag or last_modified:
+            with self.lock:
+                self.entries[key] = {
+                    'etag': etag,
+                    'last_modified': last_modified,
+                    'data': data,
+                }
+                self.save()
+
+        return data
@@ -0,0 +1,21 @@
+# Generated by Django 2.0.12 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datasets', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DrukteindexVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table_name', models.CharField(max_length=255, unique=True)),
+                ('updated_at', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -75,6 +75,15 @@ class HotspotsDrukteIndex(models.Model):
     drukteindex = models.FloatField()
 
 
+class DrukteindexVersion(models.Model):
+    """
+    Written by the analyzer each time it refills a drukteindex table.
+    Cached API responses are only valid for the current version.
+    """
+    table_name = models.CharField(max_length=255, unique=True)
+    updated_at = models.DateTimeField()
+
+
 class RealtimeAnalyzer(models.Model):
     scraped_at = models.DateTimeField(blank=True, null=False, auto_now_add=True)
     ov_fiets_crowdedness_score = models.FloatField(blank=True, null=True)
@@ -9,8 +9,6 @@ from citydynamics.datasets.models import RealtimeGoogle
 from citydynamics.datasets.models import RealtimeHistorian
 from citydynamics.datasets.models import RealtimeAnalyzer
 
-import datetime
-
 
 class BuurtcombinatieSerializer(GeoFeatureModelSerializer):
     """ A class to serialize locations as GeoJSON compatible data """
@@ -50,10 +48,8 @@ class BCIndexSerializer(ModelSerializer):
         )
 
     def get_druktecijfers_bc(self, obj):
-        today_wkday = datetime.datetime.today().weekday()
-        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
-        tomorrow_wkday = tomorrow.weekday()
-        cijfers = obj.druktecijfers_bc.filter(weekday__in=[today_wkday, tomorrow_wkday])
+        # Today / tomorrow filtering is done in the viewset prefetch.
+        cijfers = obj.druktecijfers_bc.all()
 
         return BCCijferSerializer(cijfers, many=True).data
 
@@ -111,10 +107,8 @@ class HotspotIndexSerializer(ModelSerializer):
         )
 
     def get_druktecijfers(self, obj):
-        today_wkday = datetime.datetime.today().weekday()
-        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
-        tomorrow_wkday = tomorrow.weekday()
-        cijfers = obj.druktecijfers.filter(weekday__in=[today_wkday, tomorrow_wkday])
+        # Today / tomorrow filtering is done in the viewset prefetch.
+        cijfers = obj.druktecijfers.all()
 
         return HotspotCijferSerializer(cijfers, many=True).data
 
@@ -1,8 +1,16 @@
 import requests
 import datetime
+import hashlib
 import json
+import time
 
 import expiringdict
+from django.db.models import Prefetch
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.cache import patch_cache_control
+from django.utils.http import http_date
+from django.utils.http import quote_etag
 from rest_framework import viewsets
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
@@ -14,6 +22,9 @@ from datapunt_api import rest
 from datapunt_api import pagination
 from . import models
 from . import serializers
+from .http_cache import ConditionalFetcher
+from .http_cache import parse_json
+from .http_cache import parse_ndw_velocity
 import logging
 
 log = logging.getLogger(__name__)
@@ -28,6 +39,95 @@ def convert_to_date(input_date):
     return date_obj
 
 
+def get_drukteindex_weekdays():
+    """Weekday numbers of today and tomorrow.
+
+    The drukteindex endpoints only return the values for these two days.
+    """
+    today = datetime.date.today()
+    tomorrow = today + datetime.timedelta(days=1)
+    return [today.weekday(), tomorrow.weekday()]
+
+
+# Rendered drukteindex responses. Keys contain the analyzer run version,
+# so entries of older runs are never served and simply expire.
+drukteindex_cache = expiringdict.ExpiringDict(
+    max_len=200, max_age_seconds=24 * 60 * 60)
+
+
+def get_drukteindex_version(table_name):
+    """Return the time of the last analyzer run that filled table_name."""
+    return (
+        models.DrukteindexVersion.objects
+        .filter(table_name=table_name)
+        .values_list('updated_at', flat=True)
+        .first()
+    )
+
+
+class DrukteindexCacheMixin(object):
+    """
+    Cache rendered json list responses per analyzer run.
+
+    Responses carry an ETag and Last-Modified header so clients get a
+    304 until the analyzer writes a new version or the day changes.
+    """
+
+    drukteindex_table = None
+
+    def list(self, request, *args, **kwargs):
+        updated_at = get_drukteindex_version(self.drukteindex_table)
+
+        # No analyzer run recorded yet, nothing to cache on.
+        if updated_at is None:
+            return super().list(request, *args, **kwargs)
+
+        # The selected weekdays change at midnight.
+        weekdays = get_drukteindex_weekdays()
+        midnight = datetime.datetime.combine(
+            datetime.date.today(), datetime.time())
+        last_modified = int(time.mktime(
+            max(updated_at, midnight).timetuple()))
+
+        # The absolute url covers host, filters, pagination and format.
+        key = '{}:{}:{}'.format(
+            updated_at.isoformat(), weekdays, request.build_absolute_uri())
+        etag = quote_etag(hashlib.md5(key.encode()).hexdigest())
+
+        response = get_conditional_response(
+            request._request, etag=etag, last_modified=last_modified)
+
+        if response is None:
+            response = self.cached_list(
+                etag, request, *args, **kwargs)
+
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(response, no_cache=True)
+        return response
+
+    def cached_list(self, etag, request, *args, **kwargs):
+        """
+        Return the rendered json list, serializing only on a cache miss.
+
+        Other formats (the browsable api) are not cached.
+        """
+        if request.accepted_renderer.format != 'json':
+            return super().list(request, *args, **kwargs)
+
+        content = drukteindex_cache.get(etag)
+
+        if content is None:
+            response = super().list(request, *args, **kwargs)
+            response.accepted_renderer = request.accepted_renderer
+            response.accepted_media_type = request.accepted_media_type
+            response.renderer_context = self.get_renderer_context()
+            content = response.rendered_content
+            drukteindex_cache[etag] = content
+
+        return HttpResponse(content, content_type='application/json')
+
+
 class BuurtcombinatieViewset(viewsets.ModelViewSet):
     """
     ViewSet for retrieving buurtcombinatie polygons
@@ -37,11 +137,14 @@ class BuurtcombinatieViewset(viewsets.ModelViewSet):
     serializer_class = serializers.BuurtcombinatieSerializer
 
 
-class DrukteindexBuurtcombinatieViewset(rest.DatapuntViewSet):
+class DrukteindexBuurtcombinatieViewset(
+        DrukteindexCacheMixin, rest.DatapuntViewSet):
     """
     Buurtcombinatie drukteindex API
     """
 
+    drukteindex_table = 'datasets_buurtcombinatiedrukteindex'
+
     serializer_class = serializers.BCIndexSerializer
     serializer_detail_class = serializers.BCIndexSerializer
 
@@ -51,9 +154,15 @@ class DrukteindexBuurtcombinatieViewset(rest.DatapuntViewSet):
 
     def get_queryset(self):
 
+        # Filter the cijfers inside the prefetch, so the serializer can use
+        # the prefetched rows instead of querying once per buurtcombinatie.
+        druktecijfers = models.BuurtCombinatieDrukteindex.objects.filter(
+            weekday__in=get_drukteindex_weekdays())
+
         queryset = (
             models.Buurtcombinatie.objects
-            .prefetch_related('druktecijfers_bc')
+            .prefetch_related(
+                Prefetch('druktecijfers_bc', queryset=druktecijfers))
             .order_by("naam")
         )
 
@@ -90,11 +199,14 @@ class HotspotViewset(viewsets.ModelViewSet):
     serializer_class = serializers.HotspotSerializer
 
 
-class DrukteindexHotspotViewset(rest.DatapuntViewSet):
+class DrukteindexHotspotViewset(
+        DrukteindexCacheMixin, rest.DatapuntViewSet):
     """
     Hotspot drukteindex API
     """
 
+    drukteindex_table = 'datasets_hotspotsdrukteindex'
+
     serializer_class = serializers.HotspotIndexSerializer
     serializer_detail_class = serializers.HotspotIndexSerializer
 
@@ -104,9 +216,13 @@ class DrukteindexHotspotViewset(rest.DatapuntViewSet):
 
     def get_queryset(self):
 
+        druktecijfers = models.HotspotsDrukteIndex.objects.filter(
+            weekday__in=get_drukteindex_weekdays())
+
         queryset = (
             models.Hotspots.objects
-            .prefetch_related('druktecijfers')
+            .prefetch_related(
+                Prefetch('druktecijfers', queryset=druktecijfers))
             .order_by("hotspot")
         )
 
@@ -198,6 +314,8 @@ PROXY_URLS = {
     'events': 'http://api.simfuny.com/app/api/2_0/events?callback=__ng_jsonp__.__req8.finished&offset=0&limit=25&sort=popular&search=&types[]=unlabeled&dates[]=today&startDate=&endDate=&hidelongterm=1',  # noqa
     'parking_garages': 'http://opd.it-t.nl/data/amsterdam/ParkingLocation.json',    # noqa
     'traveltime': 'http://web.redant.net/~amsterdam/ndw/data/reistijdenAmsterdam.geojson',  # noqa
+    # Average velocity per road type of the traveltime feed.
+    'traveltime_summary': 'http://web.redant.net/~amsterdam/ndw/data/reistijdenAmsterdam.geojson',  # noqa
     'ovfiets': 'http://fiets.openov.nl/locaties.json',  # noqa
     # For saving own realtime values historically.
     'realtime': 'http://localhost:8000/api/realtime/'
@@ -206,12 +324,39 @@ PROXY_URLS = {
 PARSING_DATA = {
     'parking_garages': 'geojson',
     'traveltime': 'geojson',
+    'traveltime_summary': 'ndw_velocity',
     'events': 'cleanup',
     'ovfiets': 'geojson',
     'realtime': 'json',  # For saving own realtime values historically.
 }
 
 
+def parse_text(response):
+    return response.text
+
+
+def parse_cleanup(response):
+    return cleanup(response.text)
+
+
+def parse_traveltime_summary(response):
+    """Mean velocity per road type, without loading the whole feed."""
+    sums = parse_ndw_velocity(response)
+    for road_type in sums.values():
+        road_type['mean'] = road_type['sum'] / road_type['count']
+    return sums
+
+
+PARSERS = {
+    'geojson': parse_json,
+    'ndw_velocity': parse_traveltime_summary,
+    'cleanup': parse_cleanup,
+}
+
+# Unchanged external feeds are not downloaded and parsed again.
+fetcher = ConditionalFetcher()
+
+
 def cleanup(api_response):
     """Cleanup some api cruft
 
@@ -274,7 +419,7 @@ def store(api_source, data):
 def api_proxy(request):
     """Proxy API to avoid cors headers. with a x minute cache.
 
-    provide ?api=events, parking_garages, traveltime
+    provide ?api=events, parking_garages, traveltime, traveltime_summary
 
     Historical data needs to be loaded later.
     """
@@ -305,20 +450,14 @@ def api_proxy(request):
         data = requests.get(PROXY_URLS[api_source], auth=('pipo', 'pluto')).json()
 
     else:
-        response = requests.get(PROXY_URLS[api_source])
-
-        if response.status_code != 200:
+        parse = PARSERS.get(PARSING_DATA.get(api_source), parse_text)
+        try:
+            data = fetcher.get(
+                PROXY_URLS[api_source], parse=parse, stream=True)
+        except requests.RequestException:
             log.error('EXTERNAL API FAILED: %s', PROXY_URLS[api_source])
             return r500
 
-        if api_source in PARSING_DATA:
-            if PARSING_DATA[api_source] == 'geojson':
-                data = response.json()
-            if PARSING_DATA[api_source] == 'cleanup':
-                data = cleanup(response.text)
-        else:
-            data = response.text
-
     if not data:
         log.error('EXT API DATA MISSING %s %s', api_source, data)
         # 598 (Informal convention) Network read timeout error
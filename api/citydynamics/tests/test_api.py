@@ -1,5 +1,11 @@
+# Python
+import datetime
+
 # Packages
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APITestCase
+from citydynamics.datasets import models
 from . import factories
 
 
@@ -79,3 +85,51 @@ class BrowseDatasetsTestCase(APITestCase):
             self.assertIn(
                 'count', response.data,
                 'Missing items attribute in {}'.format(url))
+
+    def test_druktecijfers_query_count(self):
+        """
+        The number of queries should not grow with the number of areas
+        """
+        url = '/api/buurtcombinatie_drukteindex/'
+
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(url)
+
+        for _ in range(3):
+            factories.BuurtcombinatieIndexFactory(
+                vollcode=factories.BuurtcombinatieFactory()
+            )
+
+        with CaptureQueriesContext(connection) as many:
+            self.client.get(url)
+
+        self.assertEqual(
+            len(few.captured_queries), len(many.captured_queries),
+            'Query count depends on number of items in {}'.format(url))
+
+    def test_druktecijfers_not_modified(self):
+        """
+        Between analyzer runs clients should get a 304
+        """
+        url = '/api/buurtcombinatie_drukteindex/'
+
+        models.DrukteindexVersion.objects.create(
+            table_name='datasets_buurtcombinatiedrukteindex',
+            updated_at=datetime.datetime.now(),
+        )
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('count', response.json())
+        etag = response['ETag']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # A new analyzer run invalidates the cached response.
+        models.DrukteindexVersion.objects.update(
+            updated_at=datetime.datetime.now() + datetime.timedelta(hours=1))
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
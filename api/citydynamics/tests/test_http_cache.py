@@ -0,0 +1,81 @@
+# Python
+import io
+import json
+from unittest import TestCase
+from unittest import mock
+
+# Packages
+from citydynamics.datasets.http_cache import ConditionalFetcher
+from citydynamics.datasets.http_cache import ndw_velocity_sums
+from citydynamics.datasets.http_cache import parse_json
+from citydynamics.datasets.http_cache import parse_ndw_velocity
+
+
+def make_response(status_code, data=None, headers=None):
+    response = mock.MagicMock(status_code=status_code, headers=headers or {})
+    response.json.return_value = data
+    return response
+
+
+class ConditionalFetcherTestCase(TestCase):
+
+    url = 'http://example.com/feed.json'
+
+    def test_not_modified_reuses_data(self):
+        session = mock.Mock()
+        fetcher = ConditionalFetcher(session)
+
+        session.get.return_value = make_response(
+            200, {'features': [1, 2]}, {'ETag': '"v1"'})
+        self.assertEqual(fetcher.get(self.url), {'features': [1, 2]})
+
+        session.get.return_value = make_response(304)
+        self.assertEqual(fetcher.get(self.url), {'features': [1, 2]})
+
+        headers = session.get.call_args[1]['headers']
+        self.assertEqual(headers['If-None-Match'], '"v1"')
+        self.assertEqual(headers['Accept-Encoding'], 'gzip')
+
+    def test_without_validators_nothing_is_cached(self):
+        session = mock.Mock()
+        fetcher = ConditionalFetcher(session)
+
+        session.get.return_value = make_response(200, {'features': []})
+        fetcher.get(self.url)
+
+        self.assertEqual(fetcher.entries, {})
+        headers = session.get.call_args[1]['headers']
+        self.assertNotIn('If-None-Match', headers)
+        self.assertNotIn('If-Modified-Since', headers)
+
+    def test_not_modified_per_parser(self):
+        # traveltime and traveltime_summary read the same url.
+        feed = {'features': [{'properties': {'Type': 'H', 'Velocity': 90}}]}
+        session = mock.Mock()
+        fetcher = ConditionalFetcher(session)
+
+        for parse in (parse_json, parse_ndw_velocity):
+            response = make_response(200, feed, {'ETag': '"v1"'})
+            response.raw = io.BytesIO(json.dumps(feed).encode())
+            session.get.return_value = response
+            fetcher.get(self.url, parse=parse, stream=True)
+
+        session.get.return_value = make_response(304)
+        self.assertEqual(fetcher.get(self.url, parse=parse_json), feed)
+        self.assertEqual(
+            fetcher.get(self.url, parse=parse_ndw_velocity, stream=True),
+            {'H': {'sum': 90, 'count': 1}})
+        self.assertEqual(fetcher.get(self.url, parse=parse_json), feed)
+
+    def test_ndw_velocity_sums(self):
+        feed = io.BytesIO(json.dumps({'features': [
+            {'properties': {'Type': 'H', 'Velocity': 100}},
+            {'properties': {'Type': 'O', 'Velocity': 30}},
+            {'properties': {'Type': 'O', 'Velocity': 50}},
+            {'properties': {'Type': 'O'}},
+        ]}).encode())
+
+        self.assertEqual(ndw_velocity_sums(feed), {
+            'H': {'sum': 100, 'count': 1},
+            'O': {'sum': 80, 'count': 2},
+        })
@@ -15,7 +15,7 @@ pg_dump -t verblijversindex \
 	 -t buurtcombinatie \
 	 -t hotspots \
 	 -t drukte_index* \
-     -t parkeren \
+	 -t 'parkeren*' \
 	 -t gvb \
 	 -Fc \
 	 -U citydynamics \
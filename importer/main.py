@@ -11,9 +11,13 @@ Module executes the import pipeline:
 import logging
 import argparse
 import configparser
+import importlib
 import os
 import os.path
 import re
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import wait
 
 # Import own modules.
 import download_from_objectstore
@@ -89,27 +93,122 @@ def execute_download_from_objectstore(objectstore_containers):
         pass
 
 
-def parse_datasets(conn, action="run"):
-    for dataset, config in CONFIG.items():
-        logger.info(f'Parsing the "{dataset}" dataset with action "{action}"...')
+def get_dependencies(config):
+    """Datasets the geometries of a dataset depend on (DEPENDS in sources.conf)."""
+    return config.get('DEPENDS', '').split()
 
-        # Get parser for dataset based on the dataset identifier/name.
-        try:
-            module = "parsers." + dataset
-            exec(f'import {module}')
-            run_parser = getattr(eval(module), action)
-            run_parser(conn=conn, data_root=DATA_ROOT, **config)
-        except AttributeError:
-            pass
 
-        logger.info('Done!\n\n')
+def build_steps(config):
+    """
+    Create the (dataset, action) steps of the import, each with the
+    steps that have to be done before it starts.
 
+    The 'run' steps can start right away. The 'add_geometries' step of
+    a dataset waits for its own 'run' step, and for both steps of the
+    datasets it depends on. Dependencies which are not enabled are
+    assumed to be in the database already.
+    """
+    steps = {}
+    for dataset, dataset_config in config.items():
+        steps[(dataset, 'run')] = set()
+        steps[(dataset, 'add_geometries')] = {(dataset, 'run')}
+        for dependency in get_dependencies(dataset_config):
+            if dependency in config:
+                steps[(dataset, 'add_geometries')].add(
+                    (dependency, 'add_geometries'))
+    return steps
+
+
+def get_parser(dataset, action):
+    """Return the action function of the parser of a dataset, or None."""
+    module = "parsers." + dataset
+    try:
+        parser_module = importlib.import_module(module)
+    except ModuleNotFoundError as e:
+        if e.name != module:
+            raise
+        return None
+    return getattr(parser_module, action, None)
 
-def main():
-    """This is the main function of this module. Starts the ETL process."""
 
-    # Create database connection.
+def limit_workers(config, budget):
+    """
+    Config of a dataset with its WORKERS setting, the number of
+    processes the parser may start itself, capped at budget.
+    """
+    workers = min(int(config.get('WORKERS', budget)), budget)
+    return dict(config, WORKERS=str(workers))
+
+
+def run_step(dataset, action, data_root, config):
+    """Run one step, with its own database connection."""
+    run_parser = get_parser(dataset, action)
+    if run_parser is None:
+        return
+
+    logger.info(f'Parsing the "{dataset}" dataset with action "{action}"...')
     conn = DatabaseInteractions().get_sqlalchemy_connection()
+    try:
+        run_parser(conn=conn, data_root=data_root, **config)
+    finally:
+        conn.close()
+    logger.info(f'Done "{dataset}" with action "{action}"!')
+
+
+def parse_datasets(config, data_root, workers=None):
+    """
+    Run all steps of the import, each step as soon as the steps
+    it depends on are done.
+
+    Independent steps run concurrently in a pool of worker processes
+    (one per cpu when workers is None). With workers=1 they run one
+    after another in the current process.
+
+    A parser starting processes of its own (WORKERS) gets the workers
+    which are not running other steps, so the import does not start
+    many more processes than workers.
+    """
+    steps = build_steps(config)
+    done = set()
+
+    if workers == 1:
+        while len(done) < len(steps):
+            ready = [step for step, before in steps.items()
+                     if step not in done and before <= done]
+            if not ready:
+                raise ValueError(f'Circular DEPENDS in sources.conf: {steps}')
+            dataset, action = ready[0]
+            run_step(dataset, action, data_root, config[dataset])
+            done.add(ready[0])
+        return
+
+    budget = workers or os.cpu_count()
+    running = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while len(done) < len(steps):
+            for step, before in steps.items():
+                if step in done or step in running.values():
+                    continue
+                if before <= done:
+                    dataset, action = step
+                    step_config = limit_workers(
+                        config[dataset], max(1, budget - len(running)))
+                    future = pool.submit(
+                        run_step, dataset, action, data_root, step_config)
+                    running[future] = step
+
+            if not running:
+                raise ValueError(f'Circular DEPENDS in sources.conf: {steps}')
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                # Raises the exception of a failed step.
+                future.result()
+                done.add(running.pop(future))
+
+
+def main():
+    """This is the main function of this module. Starts the ETL process."""
 
     # Get objectstore container names from config file and download their data.
     objectstore_containers = [v['OBJSTORE_CONTAINER'] for v in CONFIG.values()
@@ -120,13 +219,10 @@ def main():
 
     # if --download is set, stop here.
     if args.download is True:
-        conn.close()
         return
 
     # Parse all source data and write results to database (@ Docker container).
-    parse_datasets(conn, 'run')
-    parse_datasets(conn, 'add_geometries')
-    conn.close()
+    parse_datasets(CONFIG, DATA_ROOT, args.workers)
 
 
 def parse_commandine_args():
@@ -139,6 +235,10 @@ def parse_commandine_args():
 
     parser.add_argument('--download', action='store_true', default=False)
 
+    parser.add_argument(
+        '--workers', type=int, default=None,
+        help='Number of parser processes (default: number of cpus)')
+
     args = parser.parse_args()
 
     return args
@@ -1,7 +1,10 @@
+import itertools
+from operator import itemgetter
+
+import numpy as np
 import pandas as pd
-import re
 from .helper_functions import DatabaseInteractions
-from .helper_functions import GeometryQueries
+from .helper_functions import copy_dataframe
 
 import logging
 
@@ -10,10 +13,9 @@ logger = logging.getLogger(__name__)
 
 def create_alpha_table(table_name):
     return """
-    DROP TABLE IF EXISTS  public."{0}";
-
-    CREATE TABLE  public.alpha_locations_expected(
+    CREATE TABLE IF NOT EXISTS public."{0}"(
         id                      INTEGER,
+        raw_id                  INTEGER,
         place_id                VARCHAR,
         name                    TEXT,
         url                     TEXT,
@@ -28,10 +30,96 @@ def create_alpha_table(table_name):
         main_category_weight    FLOAT8,
         visit_duration          TEXT,
         types                   TEXT,
-        category                INT4);
+        category                INT4,
+        geom                    geometry,
+        vollcode                VARCHAR,
+        stadsdeelcode           VARCHAR,
+        hotspot                 VARCHAR);
+    CREATE INDEX IF NOT EXISTS "{0}_raw_id" ON public."{0}" (raw_id);
+    CREATE INDEX IF NOT EXISTS "geom_{0}" ON public."{0}" USING GIST(geom);
+
+    -- raw id after which rows have no geometry yet, see add_new_geometries.
+    CREATE TABLE IF NOT EXISTS public."{0}_geometry_mark"(
+        after_raw_id            INTEGER);
+    """.format(table_name)
+
+
+def drop_alpha_table(table_name):
+    return """
+    DROP TABLE IF EXISTS  public."{0}";
+    DROP TABLE IF EXISTS  public."{0}_geometry_mark";
+    """.format(table_name)
+
+
+def has_raw_id(table_name):
+    """Whether the alpha table exists and has the raw_id column."""
+    return """
+    SELECT EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = 'public'
+        AND table_name = '{0}'
+        AND column_name = 'raw_id');
     """.format(table_name)
 
 
+def get_high_water_mark(table_name):
+    """Last imported raw id and the next free id of the alpha table.
+
+    The raw id comes from a sequence, so a raw row that commits after a row
+    with a higher id was imported is never picked up. Rebuild the table
+    (INCREMENTAL=NO) now and then when the scraper writes concurrently.
+    """
+    return """
+    SELECT COALESCE(MAX(raw_id), 0), COALESCE(MAX(id) + 1, 0)
+    FROM public."{0}";
+    """.format(table_name)
+
+
+def set_geometry_mark(table_name, last_raw_id):
+    """
+    Remember the high-water mark taken before copying new rows, so
+    add_new_geometries only updates the rows added after it. A mark
+    left by a run whose geometries were not added yet is kept.
+    """
+    return """
+    INSERT INTO public."{0}_geometry_mark" (after_raw_id)
+    SELECT {1}
+    WHERE NOT EXISTS (SELECT 1 FROM public."{0}_geometry_mark");
+    """.format(table_name, int(last_raw_id))
+
+
+def add_new_geometries(table_name, buffer=50):
+    """
+    Add geometry, vollcode, stadsdeelcode and hotspot to the rows
+    added since the geometry mark (the rows added by the last run),
+    and remove the mark. Rows whose point has no geometry are not
+    tried again by later runs.
+    """
+    return """
+    UPDATE public."{0}" t SET
+        geom = p.geom,
+        vollcode = (
+            SELECT b.vollcode FROM buurtcombinatie b
+            WHERE st_intersects(p.geom, b.wkb_geometry) LIMIT 1),
+        stadsdeelcode = (
+            SELECT s.code FROM stadsdeel s
+            WHERE st_intersects(p.geom, s.wkb_geometry) LIMIT 1),
+        hotspot = (
+            SELECT h."hotspot" FROM hotspots h
+            WHERE st_intersects(
+                ST_Buffer(CAST(h.polygon AS geography), {1}), p.geom)
+            LIMIT 1)
+    FROM (
+        SELECT id, ST_PointFromText(
+            'POINT('||"lon"::double precision||' '||"lat"::double precision||')', 4326) AS geom
+        FROM public."{0}"
+        WHERE raw_id > (SELECT MIN(after_raw_id) FROM public."{0}_geometry_mark")
+    ) p
+    WHERE t.id = p.id;
+    DELETE FROM public."{0}_geometry_mark";
+    """.format(table_name, buffer)  # noqa
+
+
 categories_tags_mapping = {
     'default': [
         'alles_wat_geen_andere_tag_heeft', 'storage',
@@ -116,117 +204,133 @@ def evaluate_tags(tags_to_evaluate):
     return (main_category, main_category_weight)
 
 
-def parse_alpha_item(conn, i, id_counter, raw):
-    # Function to double up quotation marks for sql writing.
-    def fix_quotes(x):
-        return re.sub("'", "''", x)
-
-    place_id = raw.place_id[i]
-    name = raw.name[i]
-    url = raw.data[i]['url']
-    weekday = raw.scraped_at[i].weekday()
-    lat = raw.data[i]['location']['coordinates'][1]
-    lon = raw.data[i]['location']['coordinates'][0]
-    address = raw.data[i]['formatted_address']
-    location_type = raw.data[i]['location']['type']
-    main_category, main_category_weight = evaluate_tags(str(raw.data[i]['types']))
-    visit_duration = raw.data[i]['VisitDuration']
-    types = str(raw.data[i]['types'])
-    category = raw.data[i]['Category']
-
-    # Fix quotes for sql writing
-    name = fix_quotes(name)
-    url = fix_quotes(url)
-    address = fix_quotes(address)
-    location_type = fix_quotes(location_type)
-    visit_duration = fix_quotes(visit_duration)
-    types = fix_quotes(types)
-
-    # Loop over all expected hour intervals for each location and scrape day
-    for interval in raw.data[i]['Expected']:
-
-        # Truncate time interval to first hour of the interval
-        hour = interval['TimeInterval'][0:2]
-        hour = int(re.sub("[^0-9]", "", hour))
-        ampm = interval['TimeInterval'][1:4]
-        ampm = re.sub('[^a-zA-Z]+', '', ampm)
-        if ampm == 'pm':
-            if hour == 12:
-                pass
-            else:
-                hour += 12
-
-        # Get the expected crowdedness value for this hour (relative value)
-        expected = interval['ExpectedValue']
-
-        # Create sql query to write data to database
-        row_sql = create_row_sql(id_counter, place_id, name, url, weekday, hour, expected, lat, lon, address,
-                                 location_type, main_category, main_category_weight, visit_duration, types,
-                                 category)
-
-        # Write data to database
-        conn.execute(row_sql)
-
-        # Update id counter so all rows have a unique id
-        id_counter += 1
-
-    return id_counter
-
-
-def create_row_sql(id, place_id, name, url, weekday, hour, expected, lat, lon,
-                   address, location_type, main_category, main_category_weight, visit_duration, types,
-                   category):
-    row_sql = f"""
-INSERT INTO public.alpha_locations_expected(
-    id,
-    place_id,
-    name, url,
-    weekday, hour, expected,
-    lat, lon, address,
-    location_type,
-    main_category,
-    main_category_weight,
-    visit_duration,
-    types, category)
-VALUES(
-    '{id}',
-    '{place_id}',
-    '{name}',
-    '{url}',
-    '{weekday}',
-    '{hour}',
-    '{expected}',
-    '{lat}', '{lon}', '{address}', '{location_type}',
-    '{main_category}', '{main_category_weight}',
-    '{visit_duration}', '{types}', '{category}');
+ALPHA_COLUMNS = [
+    'id', 'raw_id', 'place_id', 'name', 'url', 'weekday', 'hour', 'expected',
+    'lat', 'lon', 'address', 'location_type', 'main_category',
+    'main_category_weight', 'visit_duration', 'types', 'category']
+
+
+def parse_hours(time_intervals):
+    """Convert TimeInterval strings (e.g. '11am-12pm') to the 24h hour
+    at the start of the interval."""
+    start = time_intervals.str.extract(r'^(\d{1,2})\s*([ap]m)', expand=True)
+    hour = start[0].astype(int) % 12
+    return hour + np.where(start[1] == 'pm', 12, 0)
+
+
+def evaluate_tag_lists(tag_lists):
+    """Map lists of tags to (main_category, main_category_weight) columns.
+
+    Each distinct combination of tags is only evaluated once.
     """
+    keys = tag_lists.map(tuple)
+    lookup = {key: evaluate_tags(key) for key in keys.unique()}
+    evaluated = keys.map(lookup)
+    return evaluated.map(itemgetter(0)), evaluated.map(itemgetter(1))
 
-    return row_sql
+
+def flatten_alpha(raw, first_id=0):
+    """Flatten the expected intervals of all raw entries into a dataframe
+    with one row per location, scrape day and hour.
+
+    Rows get consecutive ids, starting at first_id.
+    """
+    data = raw.data
+
+    # Location values, computed once per raw entry
+    locations = pd.DataFrame({
+        'raw_id': raw.id.values,
+        'place_id': raw.place_id.values,
+        'name': raw.name.values,
+        'url': data.map(itemgetter('url')).values,
+        'weekday': raw.scraped_at.dt.weekday.values,
+        'lat': data.map(lambda d: d['location']['coordinates'][1]).values,
+        'lon': data.map(lambda d: d['location']['coordinates'][0]).values,
+        'address': data.map(itemgetter('formatted_address')).values,
+        'location_type': data.map(lambda d: d['location']['type']).values,
+        'visit_duration': data.map(itemgetter('VisitDuration')).values,
+        'types': data.map(lambda d: str(d['types'])).values,
+        'category': data.map(itemgetter('Category')).values,
+    })
+    main_category, main_category_weight = evaluate_tag_lists(
+        data.map(itemgetter('types')))
+    locations['main_category'] = main_category.values
+    locations['main_category_weight'] = main_category_weight.values
+
+    # Explode the Expected arrays: repeat each location once per interval
+    expected = data.map(itemgetter('Expected'))
+    intervals = list(itertools.chain.from_iterable(expected))
+    if not intervals:
+        return pd.DataFrame(columns=ALPHA_COLUMNS)
+
+    rows = np.repeat(np.arange(len(raw)), expected.map(len).values)
+    df = locations.take(rows).reset_index(drop=True)
+
+    intervals = pd.DataFrame(intervals)
+    df['hour'] = parse_hours(intervals['TimeInterval']).values
+    # Expected crowdedness value for this hour (relative value)
+    df['expected'] = intervals['ExpectedValue'].values
+
+    # Give all rows a unique id
+    df['id'] = np.arange(first_id, first_id + len(df))
+
+    return df[ALPHA_COLUMNS]
 
 
 def add_geometries(conn, *_, **config):
     table_name = config['TABLE_NAME']
-    conn.execute(GeometryQueries.lon_lat_to_geom(table_name))
-    conn.execute(GeometryQueries.join_vollcodes(table_name))
-    conn.execute(GeometryQueries.join_stadsdeelcodes(table_name))
-    conn.execute(GeometryQueries.join_hotspot_names(table_name))
+    conn.execute(add_new_geometries(table_name))
+
+
+def read_raw(conn, source_table, after_id, chunksize):
+    """
+    Read the raw rows with an id above after_id in chunks,
+    using a server side cursor.
+    """
+    sql = f"""
+    SELECT id, place_id, name, scraped_at, data
+    FROM "{source_table}"
+    WHERE id > {after_id}
+    ORDER BY id
+    """
+    stream = conn.execution_options(stream_results=True)
+    return pd.read_sql(sql, stream, chunksize=chunksize)
 
 
 def run(conn, *_, **config):
-    """Parser for ALPHA data."""
+    """Parser for ALPHA data.
 
-    # Load raw Alpha data dump from table
+    With INCREMENTAL=YES only raw rows newer than the last imported raw row
+    are added. Otherwise, or when the table was created by an import without
+    raw ids, the table is rebuilt from the full source table.
+    """
     source_table = config['SOURCE_TABLE']
-    raw = pd.read_sql_table(source_table, conn)
+    target_table = config['TABLE_NAME']
+    batch_size = int(config.get('COPY_BATCH_SIZE', 50000))
+    chunksize = int(config.get('READ_CHUNK_SIZE', 5000))
 
     # Create table for modified Alpha data
-    target_table = config['TABLE_NAME']
+    incremental = config.get('INCREMENTAL', 'NO') == 'YES'
+    if incremental and not conn.execute(has_raw_id(target_table)).scalar():
+        logger.info('%s has no raw_id, rebuilding', target_table)
+        incremental = False
+    if not incremental:
+        conn.execute(drop_alpha_table(target_table))
     conn.execute(create_alpha_table(target_table))
 
-    # Iterate over raw entries to fill new table
-    id_counter = 0
-    for i in range(0, len(raw)):
-        id_counter = parse_alpha_item(conn, i, id_counter, raw)
+    last_raw_id, next_id = conn.execute(
+        get_high_water_mark(target_table)).fetchone()
+    logger.info('Importing raw alpha rows after id %d', last_raw_id)
+    conn.execute(set_geometry_mark(target_table, last_raw_id))
+
+    # Stream on a separate connection: the copy commits would
+    # otherwise close the server side cursor.
+    with conn.engine.connect() as read_conn:
+        chunks = read_raw(read_conn, source_table, last_raw_id, chunksize)
+        for raw in chunks:
+            expected = flatten_alpha(raw, first_id=next_id)
+            copy_dataframe(conn, expected, target_table, batch_size=batch_size)
+            next_id += len(expected)
 
 
 if __name__ == "__main__":
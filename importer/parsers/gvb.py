@@ -1,71 +1,107 @@
 import os
-import datetime
+import numpy as np
 import pandas as pd
 import logging
 from .helper_functions import GeometryQueries
+from .helper_functions import cached_parse
 
 logger = logging.getLogger(__name__)
 
 
-def run_parser(conn, data_root, **config):
-    """Parser for GVB data."""
+RITTEN_COLUMNS = ['weekdag', 'tijdstip', 'ortnr_start',
+                  'haltenaam_start', 'ortnr_eind', 'tot_ritten']
 
-    def fix_times(t, d):
-        if t >= 24:
-            t -= 24
-            if d == 1:
-                d = 7
-            else:
-                d -= 1
-        return t, d
-
-    def get_datetime(row):
-        t = datetime.time(row.tijd_numeric, 0)
-        d = [int(e) for e in row.date.split('-')]
-        d = datetime.date(d[0], d[1], d[2])
-        dt = datetime.datetime.combine(d, t)
-        return dt
+RITTEN_DTYPES = {
+    'weekdag': 'category',
+    'tijdstip': 'category',
+    'ortnr_start': 'int64',
+    'ortnr_eind': 'int64',
+    'tot_ritten': 'int64',
+}
 
-    # read raw ritten
+GVB_COLUMNS = ['halte', 'incoming', 'outgoing', 'day_numeric',
+               'timestamp', 'lat', 'lon']
+
+GVB_DTYPES = {
+    'halte': str,
+    'incoming': 'int64',
+    'outgoing': 'int64',
+    'day_numeric': 'int64',
+    'lat': 'float64',
+    'lon': 'float64',
+}
+
+DAYS = dict(ma=1, di=2, wo=3, do=4, vr=5, za=6, zo=7)
+
+# Fake week the timestamps are put in, mon 4 dec - sun 10 dec 2017.
+FIRST_DAY = pd.Timestamp('2017-12-04')
+
+
+def read_ritten(rittenpath, chunksize):
+    """Read the ritten csv in chunks, summed per start/end halte and time."""
+    keys = ['weekdag', 'tijdstip', 'ortnr_start', 'ortnr_eind']
+    chunks = pd.read_csv(
+        rittenpath, skiprows=2, header=None, names=RITTEN_COLUMNS,
+        usecols=keys + ['tot_ritten'], dtype=RITTEN_DTYPES,
+        chunksize=chunksize)
+
+    # Categories differ per chunk, so group on the values.
+    ritten = pd.concat(
+        chunk.astype({'weekdag': str, 'tijdstip': str})
+        .groupby(keys)['tot_ritten'].sum().reset_index()
+        for chunk in chunks)
+
+    return ritten.groupby(keys)['tot_ritten'].sum().reset_index()
+
+
+def fix_times(hour, day):
+    """Wrap hours of 24 and later to hour - 24 on the previous day.
+
+    Days are numbered mon = 1 to sun = 7, so 25:00 on wednesday becomes
+    01:00 on tuesday and 24:00 on monday becomes 00:00 on sunday. This is
+    what the original parser did.
+    """
+    rollover = hour >= 24
+    hour = np.where(rollover, hour - 24, hour)
+    day = np.where(rollover, (day - 2) % 7 + 1, day)
+    return hour, day
 
-    datadir = os.path.join(data_root, config['OBJECTSTORE_CONTAINER'])
-    rittenpath = os.path.join(datadir, config['RITTEN'])
 
-    ritten = pd.read_csv(rittenpath, skiprows=2, header=None)
-    ritten.columns = ['weekdag', 'tijdstip', 'ortnr_start',
-                      'haltenaam_start', 'ortnr_eind', 'tot_ritten']
-    ritten.drop('haltenaam_start', axis=1, inplace=True)
+def parse_gvb(rittenpath, locationspath, chunksize):
+
+    # read raw ritten
+    ritten = read_ritten(rittenpath, chunksize)
 
     # read locations
-    locationspath = os.path.join(datadir, config['LOCATIONS'])
     locations = pd.read_excel(locationspath)
     locations.drop(['X_COORDINAAT', 'Y_COORDINAAT'], axis=1, inplace=True)
 
     # drop unknown haltes
     locations = locations.loc[locations.haltenaam != '-- Leeg beeld --']
-
-    # add start to ritten
-    newnames = dict(OrtNr='ortnr_start', haltenaam='haltenaam_start',
-                    LAT='lat_start', LONG='lng_start')
-    locations.rename(columns=newnames, inplace=True)
-    ritten = pd.merge(ritten, locations, on='ortnr_start')
-
-    # add end to ritten
-    newnames = dict(ortnr_start='ortnr_eind', haltenaam_start='haltenaam_eind',
-                    lat_start='lat_eind', lng_start='lng_eind')
-    locations.rename(columns=newnames, inplace=True)
-    ritten = pd.merge(ritten, locations, on='ortnr_eind')
+    locations = locations.rename(columns={
+        'OrtNr': 'ortnr', 'haltenaam': 'halte', 'LAT': 'lat', 'LONG': 'lon'})
+
+    # add start and end halte to ritten
+    haltes = locations[['ortnr', 'halte']]
+    ritten = pd.merge(
+        ritten, haltes.rename(columns={'ortnr': 'ortnr_start',
+                                       'halte': 'halte_start'}),
+        on='ortnr_start')
+    ritten = pd.merge(
+        ritten, haltes.rename(columns={'ortnr': 'ortnr_eind',
+                                       'halte': 'halte_eind'}),
+        on='ortnr_eind')
 
     # incoming ritten
-    incoming = ritten.groupby(['haltenaam_eind', 'weekdag', 'tijdstip'])[
+    incoming = ritten.groupby(['halte_eind', 'weekdag', 'tijdstip'])[
         'tot_ritten'].sum().reset_index()
-    incoming.rename(columns={'haltenaam_eind': 'halte',
+    incoming.rename(columns={'halte_eind': 'halte',
                              'tot_ritten': 'incoming'}, inplace=True)
 
     # outgoing ritten
-    outgoing = ritten.groupby(['haltenaam_start', 'weekdag', 'tijdstip'])[
+    outgoing = ritten.groupby(['halte_start', 'weekdag', 'tijdstip'])[
         'tot_ritten'].sum().reset_index()
-    outgoing.rename(columns={'haltenaam_start': 'halte',
+    outgoing.rename(columns={'halte_start': 'halte',
                              'tot_ritten': 'outgoing'}, inplace=True)
 
     # merge incoming, outgoing
@@ -74,51 +110,52 @@ def run_parser(conn, data_root, **config):
     # del incoming, outgoing, data
     del incoming, outgoing, ritten
 
-    # fix tijdstip to hour
-    inout['tijd'] = [t.split(':')[0] + ':00' for t in inout.tijdstip]
+    # tijdstip (hh:mm, hours can be over 24) to hour
+    inout['hour'] = inout.tijdstip.str.split(':').str[0].astype(int)
 
     # aggregate to hour
-    inout = inout.groupby(['halte', 'weekdag', 'tijd'])[
-        'incoming', 'outgoing'].sum().reset_index()
+    inout = inout.groupby(['halte', 'weekdag', 'hour'])[
+        ['incoming', 'outgoing']].sum().reset_index()
 
     # dag van de week to numeric
-    days = dict(ma=1, di=2, wo=3, do=4, vr=5, za=6, zo=7)
-    inout['day_numeric'] = [days[d] for d in inout.weekdag]
-
-    # time range
-    inout['tijd_numeric'] = [int(t.split(':')[0]) for t in inout.tijd]
+    inout['day_numeric'] = inout.weekdag.map(DAYS)
 
     # fix hour over 24
-    inout.drop('weekdag', axis=1, inplace=True)
-    fixed_time_day = [fix_times(t, d) for t, d in zip(
-        inout.tijd_numeric, inout.day_numeric)]
-    inout['tijd_numeric'] = [x[0] for x in fixed_time_day]
-    inout['day_numeric'] = [x[1] for x in fixed_time_day]
+    hour, day = fix_times(inout.hour.values, inout.day_numeric.values)
+    inout['day_numeric'] = day
 
-    # add timestamp, fake date, mon 16 oct - sun 22 oct
-    dates = ['2017-12-' + str(i) for i in range(4, 11)]
-    inout['date'] = [dates[d - 1] for d in inout.day_numeric]
-    inout['timestamp'] = [get_datetime(row) for _, row in inout.iterrows()]
+    # add timestamp in the fake week
+    inout['timestamp'] = (
+        FIRST_DAY
+        + pd.to_timedelta(day - 1, unit='D')
+        + pd.to_timedelta(hour, unit='h'))
 
     # mean locaties
-    locations.rename(columns={
-        'ortnr_eind': 'ortnr',
-        'haltenaam_eind': 'halte',
-        'lat_eind': 'lat',
-        'lng_eind': 'lon'}, inplace=True)
     mean_locations = locations.groupby(
-        'halte')['lat', 'lon'].mean().reset_index()
-    mean_locations = mean_locations[mean_locations.halte != '-- Leeg beeld --']
+        'halte')[['lat', 'lon']].mean().reset_index()
 
     # add lat/long coordinates
     inout = pd.merge(inout, mean_locations, on='halte')
 
     # drop obsolete columns
-    inout.drop(['tijd_numeric', 'tijd', 'date'], axis=1, inplace=True)
+    inout.drop(['weekdag', 'hour'], axis=1, inplace=True)
 
     return inout
 
 
+def run_parser(conn, data_root, **config):
+    """Parser for GVB data."""
+    datadir = os.path.join(data_root, config['OBJSTORE_CONTAINER'])
+    rittenpath = os.path.join(datadir, config['RITTEN'])
+    locationspath = os.path.join(datadir, config['LOCATIONS'])
+    chunksize = int(config.get('RITTEN_CHUNK_SIZE', 500000))
+
+    return cached_parse(
+        data_root, 'gvb', [rittenpath, locationspath],
+        lambda: parse_gvb(rittenpath, locationspath, chunksize), config,
+        columns=GVB_COLUMNS, dtypes=GVB_DTYPES)
+
+
 def add_geometries(conn, *_, **config):
     table_name = config['TABLE_NAME']
     conn.execute(GeometryQueries.lon_lat_to_geom(table_name))
@@ -128,11 +165,6 @@ def add_geometries(conn, *_, **config):
 
 
 def run(conn, data_root, **config):
-    """Loading previously parsed GVB data."""
-    df = pd.read_csv(os.path.join(data_root, config['OBJSTORE_CONTAINER'],
-                                  config['PARSED_FILE']))
-    df.timestamp = pd.to_datetime(df['timestamp'])
+    """Parse the GVB data and write it to the database."""
+    df = run_parser(conn, data_root, **config)
     df.to_sql(config['TABLE_NAME'], con=conn, if_exists='append')
-
-    # Currently, no new GVB data is being parsed (take losts of time).
-    # If we want to parse a new GVB data file, we have to enable 'run_parser'.
@@ -10,12 +10,17 @@ Contains several functions to work with database tables:
     - Transform, add, enrich tables etc.
 """
 
+import hashlib
+import inspect
+import io
+import os
 import time
 import psycopg2
 import configparser
 import logging
 import subprocess
 
+import pandas as pd
 from sqlalchemy.engine.url import URL
 from sqlalchemy import create_engine
 
@@ -67,6 +72,96 @@ class DatabaseInteractions:
         return conn
 
 
+def copy_dataframe(conn, df, table_name, batch_size=50000):
+    """
+    Stream a dataframe into an existing table with COPY FROM STDIN.
+
+    Rows are sent in batches of batch_size as csv, so values are escaped
+    by the csv writer and empty values end up as NULL. All batches are
+    committed in one transaction.
+    """
+    columns = ', '.join(f'"{c}"' for c in df.columns)
+    copy_sql = f'COPY "{table_name}" ({columns}) FROM STDIN WITH (FORMAT csv)'
+
+    start = time.time()
+    raw_conn = conn.connection
+    with raw_conn.cursor() as cursor:
+        for offset in range(0, len(df), batch_size):
+            buffer = io.StringIO()
+            df.iloc[offset:offset + batch_size].to_csv(
+                buffer, header=False, index=False)
+            buffer.seek(0)
+            cursor.copy_expert(copy_sql, buffer)
+    raw_conn.commit()
+
+    duration = max(time.time() - start, 1e-6)
+    logger.info(
+        'Copied %d rows into %s in %.1fs (%d rows/s)',
+        len(df), table_name, duration, len(df) / duration)
+
+
+# Directory in the data root with parsed sources, see cached_parse.
+PARQUET_CACHE_DIR = 'parquet_cache'
+
+# Config settings which do not change the parsed result.
+UNHASHED_CONFIG = {'WORKERS', 'DEPENDS'}
+
+
+def content_hash(paths, parse, config):
+    """
+    Hash of the contents of the input files, the source code of the
+    parser module and its config: changing any of them invalidates the
+    cached result. UNHASHED_CONFIG settings are left out.
+    """
+    sha = hashlib.sha256()
+    for path in sorted(paths):
+        sha.update(os.path.basename(path).encode())
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+    sha.update(inspect.getsource(inspect.getmodule(parse)).encode())
+    settings = [item for item in sorted(config.items())
+                if item[0] not in UNHASHED_CONFIG]
+    sha.update(repr(settings).encode())
+    return sha.hexdigest()[:16]
+
+
+def cached_parse(data_root, name, paths, parse, config, columns=None, dtypes=None):
+    """
+    Return the dataframe of parse(), cached as Parquet in the data root.
+
+    The cache is keyed by content_hash of the input paths, so parse()
+    only runs when the input files, the parser or its config changed.
+    Only the given columns are kept, cast to dtypes. The result always
+    has a default index, whether it was read from the cache or parsed.
+    """
+    cache_dir = os.path.join(data_root, PARQUET_CACHE_DIR)
+    key = content_hash(paths, parse, config)
+    cache_path = os.path.join(cache_dir, f'{name}_{key}.parquet')
+
+    if os.path.exists(cache_path):
+        logger.info('Reading %s from cache %s', name, cache_path)
+        return pd.read_parquet(cache_path)
+
+    df = parse()
+    if columns is not None:
+        df = df[columns]
+    if dtypes is not None:
+        df = df.astype(dtypes)
+    # Parquet only stores a default index.
+    df = df.reset_index(drop=True)
+
+    # Remove results of older input files.
+    os.makedirs(cache_dir, exist_ok=True)
+    for filename in os.listdir(cache_dir):
+        if filename.startswith(f'{name}_') and filename.endswith('.parquet'):
+            os.remove(os.path.join(cache_dir, filename))
+
+    df.to_parquet(cache_path)
+    logger.info('Cached %s in %s', name, cache_path)
+    return df
+
+
 class GeometryQueries:
     """The functions in this class allow the modification of tables
 
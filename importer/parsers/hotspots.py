@@ -2,9 +2,20 @@ import os
 import pandas as pd
 import logging
 from .helper_functions import GeometryQueries
+from .helper_functions import cached_parse
 
 logger = logging.getLogger(__name__)
 
+# Columns of the hotspots file we use.
+HOTSPOTS_COLUMNS = [
+    'hotspot', 'lat', 'lon', 'is_alpha_hotspot', 'alpha_hotspot_name',
+    'polygon', 'notes']
+
+HOTSPOTS_DTYPES = {
+    'lat': 'float64',
+    'lon': 'float64',
+}
+
 
 def add_geometries(conn, *_, **config):
     table_name = config['TABLE_NAME']
@@ -20,7 +31,9 @@ def run(conn, data_root, **config):
     # Create dataframe from hotspots file.
     folder_path = os.path.join(data_root, config['OBJSTORE_CONTAINER'])
     path = os.path.join(folder_path, config['FILENAME'])
-    df = pd.read_csv(path)
+    df = cached_parse(
+        data_root, 'hotspots', [path], lambda: pd.read_csv(path), config,
+        columns=HOTSPOTS_COLUMNS, dtypes=HOTSPOTS_DTYPES)
 
     # Write dataframe table to database (in Docker container).
     df.to_sql(config['TABLE_NAME'], con=conn, if_exists='append')
@@ -1,10 +1,25 @@
 import os
+import re
+import numpy as np
 import pandas as pd
 import logging
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from .helper_functions import GeometryQueries
+from .helper_functions import cached_parse
+from .helper_functions import copy_dataframe
 
 logger = logging.getLogger(__name__)
 
+# Columns of the timeslot files we use, and weekday and hour.
+PARKEREN_COLUMNS = [
+    'id', 'code', 'vakken', 'occupancy', 'st_astext', 'weekday', 'hour']
+
+PARKEREN_DTYPES = {
+    'weekday': 'int64',
+    'hour': 'int64',
+}
+
 
 def parse_parkeer_timeslot(path_to_dir, file):
     day_mapping = {
@@ -21,13 +36,14 @@ def parse_parkeer_timeslot(path_to_dir, file):
     day_nr = day_mapping[day_str]
     start_hour = int(file[12:14])
     end_hour = int(file[15:17])
-    hour_range = list(range(start_hour, end_hour + 1))
-    df_temp_all_hours = pd.DataFrame()
+    hour_range = np.arange(start_hour, end_hour + 1)
     df_temp = pd.read_csv(os.path.join(path_to_dir, file))
     df_temp['weekday'] = day_nr
-    for hour in hour_range:
-        df_temp['hour'] = hour
-        df_temp_all_hours = pd.concat([df_temp_all_hours, df_temp])
+
+    # One copy of the rows per hour in the timeslot.
+    rows = np.tile(np.arange(len(df_temp)), len(hour_range))
+    df_temp_all_hours = df_temp.iloc[rows].copy()
+    df_temp_all_hours['hour'] = np.repeat(hour_range, len(df_temp))
 
     return df_temp_all_hours
 
@@ -39,35 +55,84 @@ def add_geometries(conn, *_, **config):
     conn.execute(GeometryQueries.join_hotspot_names(table_name, geometry_column='centroid'))
 
 
+# Timeslot files of one day, e.g. 2018_w16_Tu_09_12_BETAALDP.csv.
+# Files of a range of days (Ma_Fr, Sa_Su) do not match.
+TIMESLOT_FILE = re.compile(
+    r'^(?P<year>\d{4})_w(?P<week>\d{2})_(Ma|Tu|We|Th|Fr|Sa|Su)_\d{2}_\d{2}.*BETAALDP\.csv$')
+
+
+def files_per_week(files):
+    """Group the timeslot files per ISO week, as yyyyww."""
+    weeks = {}
+    for filename in sorted(files):
+        match = TIMESLOT_FILE.match(filename)
+        if match:
+            week = int(match.group('year')) * 100 + int(match.group('week'))
+            weeks.setdefault(week, []).append(filename)
+    return weeks
+
+
+def create_week_partition(conn, table_name, week):
+    """(Re)create the child table of table_name holding one week."""
+    partition = f'{table_name}_{week}'
+    conn.execute(f"""
+    DROP TABLE IF EXISTS "{partition}";
+    CREATE TABLE "{partition}" (CHECK (week = {week})) INHERITS ("{table_name}");
+    CREATE INDEX ON "{partition}" (vollcode, weekday, hour);
+    """)
+    return partition
+
+
 def run(conn, data_root, **config):
-    """Parser for PARKEER data."""
+    """Parser for PARKEER data.
+
+    Every week in DATA_FOLDER is written to its own partition (child
+    table) of TABLE_NAME, with a week column holding the ISO week
+    as yyyyww.
+
+    TABLE_NAME is recreated on every import: add_geometries turns its
+    st_astext text column into a geometry, which the copy of the next
+    import could not write to, and older imports had no week column.
+    All weeks are written again, mostly from the parquet cache.
+    """
 
     path_to_dir = os.path.join(data_root, config['OBJSTORE_CONTAINER'],
                                config['DATA_FOLDER'])
-    files = os.listdir(path_to_dir)
+    weeks = files_per_week(os.listdir(path_to_dir))
+
+    workers = int(config.get('WORKERS', os.cpu_count()))
+    table_name = config['TABLE_NAME']
 
-    week_number = 16
-    files_in_week_number = []
+    conn.execute(f'DROP TABLE IF EXISTS "{table_name}" CASCADE')
 
-    # TODO: Turn into regex to create "files_in_week_number" list
-    for filename in files:
-        if '2018_w{}'.format(week_number) in filename:
-            if 'BETAALDP.csv' in filename:
-                if 'Ma_Fr' not in filename:
-                    if 'Sa_Su' not in filename:
-                        files_in_week_number.append(filename)
+    def parse_week(files):
+        # Read the timeslot files in parallel, and concat them once.
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            timeslots = list(executor.map(
+                partial(parse_parkeer_timeslot, path_to_dir), files))
 
-    df_week = pd.DataFrame()
+        return pd.concat(timeslots)
 
-    for file in files_in_week_number:
-        df_timeslot = parse_parkeer_timeslot(path_to_dir, file)
-        df_week = pd.concat([df_week, df_timeslot])
+    for week, files in sorted(weeks.items()):
+        logger.info('Parsing week %d (%d files)...', week, len(files))
+        paths = [os.path.join(path_to_dir, file) for file in files]
+        df_week = cached_parse(
+            data_root, f'parkeren_{week}', paths,
+            lambda: parse_week(files), config,
+            columns=PARKEREN_COLUMNS, dtypes=PARKEREN_DTYPES)
 
-    # print(df_week.columns.tolist())
-    df_week['occupancy_times_vakken'] = df_week['occupancy'] * df_week['vakken'] / 100
-    df_week['vollcode'] = df_week.code.str[0:3]
+        df_week['occupancy_times_vakken'] = df_week['occupancy'] * df_week['vakken'] / 100
+        df_week['vollcode'] = df_week.code.str[0:3]
+        df_week['week'] = week
+        df_week = df_week.reset_index()
+
+        # The parent table gets the columns of the first week.
+        if not conn.dialect.has_table(conn, table_name):
+            df_week.head(0).to_sql(table_name, con=conn, index=False)
+            conn.execute(f'CREATE INDEX ON "{table_name}" (vollcode, weekday, hour)')
+
+        partition = create_week_partition(conn, table_name, week)
+        logger.info('Writing week %d to %s...', week, partition)
+        copy_dataframe(conn, df_week, partition)
 
-    logger.info('Writing data to database...')
-    table_name = config['TABLE_NAME']
-    df_week.to_sql(table_name, con=conn, if_exists='append')
     logger.info('...done')
@@ -1,15 +1,12 @@
 import pandas as pd
 import os
 import logging
+from .helper_functions import cached_parse
 
 logger = logging.getLogger(__name__)
 
 
-def run(conn, data_root, **config):
-    """Parser for verblijversindex data."""
-
-    folder_path = os.path.join(data_root, config['OBJSTORE_CONTAINER'])
-    path = os.path.join(folder_path, config['FILENAME'])
+def parse_verblijversindex(path):
     df = pd.read_excel(path, sheet_name=3)
 
     cols = ['wijk',
@@ -40,4 +37,17 @@ def run(conn, data_root, **config):
 
     df = df.head(98)  # Remove last two rows (no relevant data there)
 
+    return df
+
+
+def run(conn, data_root, **config):
+    """Parser for verblijversindex data."""
+
+    folder_path = os.path.join(data_root, config['OBJSTORE_CONTAINER'])
+    path = os.path.join(folder_path, config['FILENAME'])
+    df = cached_parse(
+        data_root, 'verblijversindex', [path],
+        lambda: parse_verblijversindex(path), config,
+        dtypes={'vollcode': str})
+
     df.to_sql('verblijversindex', con=conn, if_exists='append')
@@ -27,19 +27,41 @@
 #
 # - Alpha Realtime
 #     - https://drukteradar.amsterdam.nl/api/realtime/
+#
+#
+# Usage:
+#
+#   python realtime.py                     Compute and store the score once.
+#   python realtime.py --daemon            Compute and store the score every --interval seconds (default
+#                                          REALTIME_INTERVAL or 300), optionally serving the latest score
+#                                          on --health_port. With --batch_size N the scores are written
+#                                          N at a time.
 ##############################################################################################################
 
 
 ##############################################################################################################
 # Imports and settings
-import urllib.request
+import argparse
+import os
 import json
 import datetime
 import requests
 import re
+import signal
+import sys
+import time
+import threading
 import logging
+from concurrent.futures import ThreadPoolExecutor, wait
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
+from http_cache import ConditionalFetcher
+from http_cache import parse_ndw_velocity
 import configparser
+from sqlalchemy import Column
+from sqlalchemy import MetaData
+from sqlalchemy import Table
 from sqlalchemy import create_engine
 from sqlalchemy.engine.url import URL
 
@@ -50,6 +72,33 @@ log = logging.getLogger(__name__)
 # load config file
 config_auth = configparser.RawConfigParser()
 config_auth.read('auth.conf')
+
+# Timeout in seconds of a single request to a realtime source.
+SOURCE_TIMEOUT = 10
+# Attempts per source, and the base of the exponential backoff between them.
+SOURCE_ATTEMPTS = 3
+SOURCE_BACKOFF = 2
+# Seconds to wait for all sources. Sources that are not done by then are left out.
+SOURCES_DEADLINE = 60
+# Seconds between two computations of the crowdedness score in daemon mode.
+INTERVAL = int(os.getenv('REALTIME_INTERVAL', 300))
+# Number of scores buffered before they are written in daemon mode.
+BATCH_SIZE = int(os.getenv('REALTIME_BATCH_SIZE', 1))
+
+# One HTTP session for all sources, so connections are kept alive between
+# ticks in daemon mode.
+session = requests.Session()
+session.mount('http://', HTTPAdapter(pool_maxsize=10))
+session.mount('https://', HTTPAdapter(pool_maxsize=10))
+
+# Feeds which did not change since the previous tick are not downloaded again.
+# Set REALTIME_HTTP_CACHE to a file to keep the cache between runs.
+fetcher = ConditionalFetcher(session, cache_file=os.getenv('REALTIME_HTTP_CACHE'))
+
+# Latest computed crowdedness score, served by the health check in daemon mode.
+# Replaced as a whole by tick, never changed in place, so the health check
+# thread always sees a complete score.
+LATEST = {}
 ##############################################################################################################
 
 
@@ -64,8 +113,15 @@ def rescale(org_val, org_min, org_max, new_min, new_max):
     return (new_max - new_min) * (org_val - org_min) / (org_max - org_min) + new_min
 
 
+_engine = None
+
+
 def get_conn():
-    """Create a connection to the database."""
+    """Return the (pooled) database engine, creating it on first use."""
+    global _engine
+    if _engine is not None:
+        return _engine
+
     dbconfig = 'docker'
     postgres_url = URL(
         drivername='postgresql',
@@ -75,63 +131,87 @@ def get_conn():
         port=config_auth.get(dbconfig, 'port'),
         database=config_auth.get(dbconfig, 'dbname')
     )
-    conn = create_engine(postgres_url)
-    return conn
-
-
-def create_row_sql(scraped_at, ov_fiets_crowdedness_score, ndw_crowdedness_score, pr_crowdedness_score,
-                   knmi_crowdedness_score, weercijfer, combined_crowdedness_score, alp_mean, alp_count, diff,
-                   w_fiets, w_ndw, w_pr, w_knmi, w_weer):
-    row_sql = f"""
-INSERT INTO public.datasets_realtimeanalyzer(
-    scraped_at,
-    ov_fiets_crowdedness_score,
-    ndw_crowdedness_score,
-    pr_crowdedness_score,
-    knmi_crowdedness_score,
-    weercijfer,
-    combined_crowdedness_score,
-    alp_mean,
-    alp_count,
-    diff,
-    w_fiets,
-    w_ndw,
-    w_pr,
-    w_knmi,
-    w_weer)
-VALUES(
-    '{scraped_at}',
-    '{ov_fiets_crowdedness_score}',
-    '{ndw_crowdedness_score}',
-    '{pr_crowdedness_score}',
-    '{knmi_crowdedness_score}',
-    '{weercijfer}',
-    '{combined_crowdedness_score}',
-    '{alp_mean}',
-    '{alp_count}',
-    '{diff}',
-    '{w_fiets}',
-    '{w_ndw}',
-    '{w_pr}',
-    '{w_knmi}',
-    '{w_weer}');
+    _engine = create_engine(postgres_url, pool_size=1, pool_pre_ping=True)
+    return _engine
+
+
+REALTIME_COLUMNS = [
+    'scraped_at',
+    'ov_fiets_crowdedness_score',
+    'ndw_crowdedness_score',
+    'pr_crowdedness_score',
+    'knmi_crowdedness_score',
+    'weercijfer',
+    'combined_crowdedness_score',
+    'alp_mean',
+    'alp_count',
+    'diff',
+    'w_fiets',
+    'w_ndw',
+    'w_pr',
+    'w_knmi',
+    'w_weer',
+]
+
+realtime_table = Table(
+    'datasets_realtimeanalyzer', MetaData(), *[Column(c) for c in REALTIME_COLUMNS], schema='public')
+
+
+class RowWriter(object):
+    """Insert rows into datasets_realtimeanalyzer on a persistent connection.
+
+    Rows are buffered until batch_size rows are waiting, and then written with
+    one multi-row insert with bound parameters. Rows which could not be written
+    stay in the buffer and are retried with the next flush.
     """
 
-    return row_sql
+    def __init__(self, engine, batch_size=1):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.conn = None
+        self.rows = []
+
+    def add(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+
+        if self.conn is None:
+            self.conn = self.engine.connect()
+
+        try:
+            self.conn.execute(realtime_table.insert().values(self.rows))
+        except Exception:
+            # Start with a fresh connection next time.
+            self.conn.close()
+            self.conn = None
+            raise
+
+        log.debug(f"Wrote {len(self.rows)} rows.")
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
 ##############################################################################################################
 
 
 ##############################################################################################################
 # OV Fiets
 
-def ov_fiets():
+def ov_fiets(timeout=SOURCE_TIMEOUT):
 
     ov_fiets_url = "http://fiets.openov.nl/locaties.json"
 
     # Load OV-fiets data
-    with urllib.request.urlopen(ov_fiets_url) as url:
-        ov_fiets = json.loads(url.read().decode())
-        ov_fiets = ov_fiets['locaties']
+    ov_fiets = fetcher.get(ov_fiets_url, timeout=timeout)
+    ov_fiets = ov_fiets['locaties']
 
     # Filter on location Amsterdam
     ov_fiets_amsterdam = dict((x, ov_fiets[x]) for x in ov_fiets if 'Amsterdam' in ov_fiets[x]['name'])
@@ -164,32 +244,18 @@ def ov_fiets():
 ##############################################################################################################
 # NDW
 
-def ndw():
+def ndw(timeout=SOURCE_TIMEOUT):
 
     ndw_url = "http://web.redant.net/~amsterdam/ndw/data/reistijdenAmsterdam.geojson"
 
-    # Load NDW realtime data
-    with urllib.request.urlopen(ndw_url) as url:
-        ndw = json.loads(url.read().decode())
-        ndw = ndw['features']
-
-    # Filter on availability of velocity
-    ndw_velocity = [(x['properties']['Type'], x['properties']['Velocity']) for x in ndw if
-                    'Velocity' in x['properties'].keys()]
+    # Sum velocities per road type, streaming through the (large) feed.
+    ndw = fetcher.get(ndw_url, parse=parse_ndw_velocity, timeout=timeout, stream=True)
 
     # Compute average speeds for each road type
-    H_sum = 0
-    H_count = 0
-    O_sum = 0
-    O_count = 0
-
-    for road_type, velocity in ndw_velocity:
-        if road_type == "H":
-            H_sum += velocity
-            H_count += 1
-        if road_type == "O":
-            O_sum += velocity
-            O_count += 1
+    H_sum = ndw['H']['sum']
+    H_count = ndw['H']['count']
+    O_sum = ndw['O']['sum']
+    O_count = ndw['O']['count']
 
     H_mean = H_sum / H_count
     O_mean = O_sum / O_count
@@ -217,12 +283,12 @@ def ndw():
 ##############################################################################################################
 # P+R
 
-def pr():
+def pr(timeout=SOURCE_TIMEOUT):
 
     pr_url = "http://opd.it-t.nl/data/amsterdam/ParkingLocation.json"
 
     # Load json
-    pr = requests.get(pr_url).json()
+    pr = fetcher.get(pr_url, timeout=timeout)
     pr = pr['features']
 
     # Filter on 'State' = 'ok'
@@ -254,14 +320,14 @@ def pr():
 ##############################################################################################################
 # Weercijfer
 
-def weer():
+def weer(timeout=SOURCE_TIMEOUT):
 
     # Get raw website data
     weeronline_url = "https://www.weeronline.nl/Europa/Nederland/Amsterdam/4058223"
     headers = {'User-Agent': "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
                              "(KHTML, like Gecko) Chrome/67.0.3396.79 Safari/537.36"}
     cookies = {'cookieConsent': 'true'}
-    r = requests.get(weeronline_url, headers=headers, cookies=cookies)
+    r = session.get(weeronline_url, headers=headers, cookies=cookies, timeout=timeout)
 
     # Parse with BeautifulSoup
     soup = BeautifulSoup(r.text, 'html.parser')
@@ -280,15 +346,14 @@ def weer():
 ##############################################################################################################
 # KNMI
 
-def knmi():
+def knmi(timeout=SOURCE_TIMEOUT):
 
     # Documentatie URL: http://weerlive.nl/delen.php
     knmi_url = "https://weerlive.nl/api/json-data-10min.php?key=demo&locatie=Amsterdam"
 
     # Load NDW realtime data
-    with urllib.request.urlopen(knmi_url) as url:
-        knmi = json.loads(url.read().decode())
-        knmi = knmi['liveweer'][0]
+    knmi = session.get(knmi_url, timeout=timeout).json()
+    knmi = knmi['liveweer'][0]
 
     # Heuristic: compute own KNMI "weercijfer" score. Range: [0-1]
     weer_scores = {
@@ -323,11 +388,11 @@ def knmi():
 ##############################################################################################################
 # Alpha realtime score (only used for validation)
 
-def alp():
+def alp(timeout=SOURCE_TIMEOUT):
 
     # Get Alpha data
     alp_url = "https://drukteradar.amsterdam.nl/api/realtime_quantillion/"
-    alp = requests.get(alp_url, auth=('pipo', 'pluto')).json()
+    alp = session.get(alp_url, auth=('pipo', 'pluto'), timeout=timeout).json()
     alp = alp['results']
 
     # Compute mean Alpha realtime value
@@ -359,56 +424,112 @@ def alp():
 ##############################################################################################################
 # Main routine
 
-def main():
-    '''Compute crowdedness score by combining multiple realtime datasources.'''
+# Realtime sources: name -> (function computing the score, weight in the combined score).
+SOURCES = {
+    'ov_fiets': (ov_fiets, 10),
+    'ndw': (ndw, 35),
+    'pr': (pr, 25),
+    'knmi': (knmi, 15),
+    'weer': (weer, 15),
+}
 
-    # Get crowdedness scores for all sources.
-    success = False
-    attempts = 0
-    while success is False and attempts < 10:
+
+def fetch_score(name, source):
+    """Get the score of one source, retrying with exponential backoff.
+
+    Returns None when all attempts failed.
+    """
+    for attempt in range(SOURCE_ATTEMPTS):
         try:
-            ov_fiets_crowdedness_score = ov_fiets()
-            log.info(f"ov_fiets_crowdedness_score: {ov_fiets_crowdedness_score}")
-            ndw_crowdedness_score = ndw()
-            log.info(f"ndw_crowdedness_score: {ndw_crowdedness_score}")
-            pr_crowdedness_score = pr()
-            log.info(f"pr_crowdedness_score: {pr_crowdedness_score}")
-            knmi_crowdedness_score = knmi()
-            log.info(f"knmi_crowdedness_score: {knmi_crowdedness_score}")
-            weercijfer = weer()
-            log.info(f"weercijfer: {weercijfer}")
-            success = True
+            score = source(timeout=SOURCE_TIMEOUT)
+            log.info(f"{name} score: {score}")
+            return score
         except Exception:
-            attempts += 1
+            log.exception(f"[{name}] attempt {attempt + 1} failed.")
+            if attempt + 1 < SOURCE_ATTEMPTS:
+                time.sleep(SOURCE_BACKOFF ** attempt)
+    return None
 
-    # If no scores have been gathered after all attempts, exit script.
-    if success is False:
-        log.info("Could not gather data to compute crowdedness score. Exiting.")
-        exit()
 
-    # Define weights for each source.
-    w_fiets = 10
-    w_ndw = 35
-    w_pr = 25
-    w_knmi = 15
-    w_weer = 15
+# One thread per source, reused by every tick of the daemon.
+SOURCES_POOL = ThreadPoolExecutor(max_workers=len(SOURCES))
+
+# Latest fetch of every source: name -> future.
+SOURCE_FUTURES = {}
+
+
+def fetch_scores():
+    """Get the scores of all sources concurrently.
+
+    Sources which failed, or were not done before SOURCES_DEADLINE, get None.
+    A source still running since an earlier call is not started again, its
+    running fetch is waited for instead.
+    """
+    futures = {}
+    for name, (source, _) in SOURCES.items():
+        future = SOURCE_FUTURES.get(name)
+        if future is None or future.done():
+            future = SOURCES_POOL.submit(fetch_score, name, source)
+            SOURCE_FUTURES[name] = future
+        else:
+            log.warning(f"[{name}] previous fetch still running.")
+        futures[name] = future
+    wait(futures.values(), timeout=SOURCES_DEADLINE)
+
+    scores = {}
+    for name, future in futures.items():
+        scores[name] = future.result() if future.done() else None
+        if scores[name] is None:
+            log.warning(f"[{name}] no score, leaving it out of the combined score.")
+    return scores
+
+
+def source_weights(scores, hour):
+    """Weights of the sources for the given hour.
+
+    Sources without a score get weight 0, so the combined score is
+    normalised over the remaining sources.
+    """
+    weights = {name: weight for name, (_, weight) in SOURCES.items()}
 
     # Turn KNMI and weercijfer weights down at night.
     # Retained percentage of weight (@ each hour): 90@1h 65@2h, 40@3h, 15@4h, 40@5h, 65@6h, 90@7h
-    hour = datetime.datetime.now().hour
     if hour > 0 and hour < 8:
         offset = abs(4 - hour) + 0.6
         factor = .25 * offset
-        w_knmi *= factor
-        w_weer *= factor
+        weights['knmi'] *= factor
+        weights['weer'] *= factor
+
+    for name, score in scores.items():
+        if score is None:
+            weights[name] = 0
+
+    return weights
+
 
-    # Compute combined crowdedness sccore.
-    combined_crowdedness_score = ((w_fiets * ov_fiets_crowdedness_score +
-                                   w_ndw * ndw_crowdedness_score +
-                                   w_pr * pr_crowdedness_score +
-                                   w_knmi * knmi_crowdedness_score +
-                                   w_weer * weercijfer)
-                                  / (w_fiets + w_ndw + w_pr + w_knmi + w_weer))
+def combine_scores(scores, weights):
+    """Weighted mean of the available scores."""
+    total_weight = sum(weights.values())
+    return sum(weights[name] * score for name, score in scores.items() if score is not None) / total_weight
+
+
+def compute():
+    """Compute the crowdedness score by combining multiple realtime datasources.
+
+    Returns the row for the datasets_realtimeanalyzer table, or None when no
+    source could be read.
+    """
+
+    # Get crowdedness scores for all sources.
+    scores = fetch_scores()
+
+    if all(score is None for score in scores.values()):
+        log.info("Could not gather data to compute crowdedness score.")
+        return None
+
+    # Compute combined crowdedness score.
+    weights = source_weights(scores, datetime.datetime.now().hour)
+    combined_crowdedness_score = combine_scores(scores, weights)
 
     # Show resulting crowdedness value
     log.info(f"combined_crowdedness_score: {combined_crowdedness_score}")
@@ -426,30 +547,140 @@ def main():
         log.info("No alpha value present. Leaving the difference as 0.")
         pass
 
-    # write to db
-    conn = get_conn()
-    scraped_at = datetime.datetime.now()
-    row_sql = create_row_sql(scraped_at,
-                             ov_fiets_crowdedness_score,
-                             ndw_crowdedness_score,
-                             pr_crowdedness_score,
-                             knmi_crowdedness_score,
-                             weercijfer,
-                             combined_crowdedness_score,
-                             alp_mean,
-                             alp_count,
-                             diff,
-                             w_fiets,
-                             w_ndw,
-                             w_pr,
-                             w_knmi,
-                             w_weer)
-    conn.execute(row_sql)
+    return {
+        'scraped_at': datetime.datetime.now(),
+        'ov_fiets_crowdedness_score': scores['ov_fiets'],
+        'ndw_crowdedness_score': scores['ndw'],
+        'pr_crowdedness_score': scores['pr'],
+        'knmi_crowdedness_score': scores['knmi'],
+        'weercijfer': scores['weer'],
+        'combined_crowdedness_score': combined_crowdedness_score,
+        'alp_mean': alp_mean,
+        'alp_count': alp_count,
+        'diff': diff,
+        'w_fiets': weights['ov_fiets'],
+        'w_ndw': weights['ndw'],
+        'w_pr': weights['pr'],
+        'w_knmi': weights['knmi'],
+        'w_weer': weights['weer'],
+    }
+
+
+def tick(writer):
+    """Compute, store and remember one crowdedness score."""
+    global LATEST
+
+    row = compute()
+    if row is None:
+        return None
+
+    writer.add(row)
+    LATEST = dict(row)
+    return row
+
+
+class HealthHandler(BaseHTTPRequestHandler):
+    """Serve the latest crowdedness score as json.
+
+    Responds with 503 when no score was computed within two intervals.
+    """
+
+    interval = INTERVAL
+
+    def do_GET(self):
+        latest = dict(LATEST)
+        age = None
+        if latest:
+            age = (datetime.datetime.now() - latest['scraped_at']).total_seconds()
+            latest['scraped_at'] = latest['scraped_at'].isoformat()
+
+        healthy = age is not None and age < 2 * self.interval
+        body = json.dumps({'healthy': healthy, 'age': age, 'latest': latest})
+
+        self.send_response(200 if healthy else 503)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, format, *args):
+        log.debug(format, *args)
+
+
+def serve_health(port, interval):
+    """Start the health check http server in a background thread."""
+    HealthHandler.interval = interval
+    server = HTTPServer(('', port), HealthHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    log.info(f"Health check on port {port}")
+    return server
+
+
+def run_daemon(interval=INTERVAL, health_port=None, batch_size=BATCH_SIZE):
+    """Compute the crowdedness score every interval seconds, forever.
+
+    HTTP sessions and the database connection are reused between ticks.
+    Rows are written per batch_size ticks, and on shutdown.
+    """
+    if health_port:
+        serve_health(health_port, interval)
+
+    # Stop (and flush the buffered rows) on docker stop.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    writer = RowWriter(get_conn(), batch_size)
+    next_tick = time.monotonic()
+    try:
+        while True:
+            try:
+                tick(writer)
+            except Exception:
+                log.exception("Computing the crowdedness score failed.")
+
+            # Keep a fixed cadence, regardless of how long the tick took.
+            next_tick += interval
+            time.sleep(max(0, next_tick - time.monotonic()))
+    finally:
+        writer.close()
+
+
+def main(args):
+    if args.daemon:
+        run_daemon(args.interval, args.health_port, args.batch_size)
+        return
+
+    writer = RowWriter(get_conn())
+    row = tick(writer)
+    writer.close()
+
+    # If no scores have been gathered at all, exit script.
+    if row is None:
+        log.info("Exiting.")
+        exit()
 
 ##############################################################################################################
 
 
 ##############################################################################################################
 if __name__ == "__main__":
-    main()
+    desc = "Compute the realtime crowdedness score."
+    inputparser = argparse.ArgumentParser(desc)
+
+    inputparser.add_argument(
+        "--daemon", action="store_true", default=False,
+        help="Keep running and compute the score every interval")
+
+    inputparser.add_argument(
+        "--interval", type=int, default=INTERVAL,
+        help="Seconds between two scores in daemon mode")
+
+    inputparser.add_argument(
+        "--health_port", type=int, default=None,
+        help="Serve the latest score on this port in daemon mode")
+
+    inputparser.add_argument(
+        "--batch_size", type=int, default=BATCH_SIZE,
+        help="Number of scores written at once in daemon mode")
+
+    main(inputparser.parse_args())
 ##############################################################################################################
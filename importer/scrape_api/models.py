@@ -3,7 +3,7 @@ import logging
 import argparse
 
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import Column, Integer, String, TIMESTAMP
+from sqlalchemy import Column, Index, Integer, String, TIMESTAMP
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.schema import Sequence
@@ -81,6 +81,11 @@ class GoogleRawLocationsRealtime(Base):
     Raw json location information realtime
     """
     __tablename__ = f'google_raw_locations_realtime_{ENVIRONMENT}'
+    # one row per place per scrape, used by ON CONFLICT in slurp_api.
+    __table_args__ = (
+        Index(f'{__tablename__}_place_scraped', 'place_id', 'scraped_at',
+              unique=True),
+    )
     id = Column(Integer, Sequence('grl_seq'), primary_key=True)
     place_id = Column(String, index=True)
     scraped_at = Column(TIMESTAMP, index=True)
@@ -93,6 +98,11 @@ class GoogleRawLocationsExpected(Base):
     Raw json location information of expected data
     """
     __tablename__ = f'google_raw_locations_expected_{ENVIRONMENT}'
+    # one row per place per scrape, used by ON CONFLICT in slurp_api.
+    __table_args__ = (
+        Index(f'{__tablename__}_place_scraped', 'place_id', 'scraped_at',
+              unique=True),
+    )
     id = Column(Integer, Sequence('grl_seq'), primary_key=True)
     place_id = Column(String, index=True)
     scraped_at = Column(TIMESTAMP, index=True)
@@ -141,6 +151,11 @@ class GoogleRawLocationsRealtimeCurrent(Base):
     Raw json location information realtime
     """
     __tablename__ = f'google_raw_locations_realtime_current_{ENVIRONMENT}'
+    # one row per place per scrape, used by ON CONFLICT in slurp_api.
+    __table_args__ = (
+        Index(f'{__tablename__}_place_scraped', 'place_id', 'scraped_at',
+              unique=True),
+    )
     id = Column(Integer, Sequence('grl_seq'), primary_key=True)
     place_id = Column(String, index=True)
     scraped_at = Column(TIMESTAMP, index=True)
@@ -153,6 +168,11 @@ class GoogleRawLocationsExpectedCurrent(Base):
     Raw json location information expected
     """
     __tablename__ = f'google_raw_locations_expected_current_{ENVIRONMENT}'
+    # one row per place per scrape, used by ON CONFLICT in slurp_api.
+    __table_args__ = (
+        Index(f'{__tablename__}_place_scraped', 'place_id', 'scraped_at',
+              unique=True),
+    )
     id = Column(Integer, Sequence('grl_seq'), primary_key=True)
     place_id = Column(String, index=True)
     scraped_at = Column(TIMESTAMP, index=True)
@@ -160,6 +180,35 @@ class GoogleRawLocationsExpectedCurrent(Base):
     data = Column(JSONB)
 
 
+class ScrapeCheckpoint(Base):
+    """
+    Pages of an endpoint which are stored, used by slurp_api --resume
+    """
+    __tablename__ = f'scrape_checkpoints_{ENVIRONMENT}'
+    __table_args__ = (
+        Index(f'{__tablename__}_page', 'endpoint', 'start_date', 'skip',
+              unique=True),
+    )
+    id = Column(Integer, Sequence('grl_seq'), primary_key=True)
+    endpoint = Column(String, nullable=False)
+    # '' for the undated current endpoints, NULLs would never conflict.
+    start_date = Column(String, nullable=False)
+    skip = Column(Integer, nullable=False)
+    # number of locations in the page, a full page has a next page.
+    rows = Column(Integer)
+    done_at = Column(TIMESTAMP)
+
+
+class DedupeMark(Base):
+    """
+    Highest id of a table checked by slurp_api.delete_duplicates
+    """
+    __tablename__ = f'scrape_dedupe_marks_{ENVIRONMENT}'
+    id = Column(Integer, Sequence('grl_seq'), primary_key=True)
+    tablename = Column(String, unique=True)
+    last_id = Column(Integer)
+
+
 class GoogleLocations(Base):
     """
     Unique locations with proper bag_id / vestiging ids
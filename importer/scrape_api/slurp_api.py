@@ -17,21 +17,38 @@ port: 3001
 username: gemeenteAmsterdam
 """
 
-import gevent
-import datetime
-import grequests
-from settings import LIMIT
-import os
-import models
-import logging
-import argparse
-import settings
-import os.path
-
-from gevent.queue import JoinableQueue
-from dateutil import parser
-
-from psycogreen.gevent import patch_psycopg
+from gevent import monkey
+monkey.patch_all(thread=False, select=False)
+
+import csv  # noqa: E402
+import io  # noqa: E402
+import gevent  # noqa: E402
+import datetime  # noqa: E402
+import requests  # noqa: E402
+from settings import LIMIT  # noqa: E402
+import os  # noqa: E402
+import models  # noqa: E402
+import logging  # noqa: E402
+import argparse  # noqa: E402
+import settings  # noqa: E402
+import os.path  # noqa: E402
+import time  # noqa: E402
+
+from collections import defaultdict  # noqa: E402
+from urllib.parse import urlparse  # noqa: E402
+
+from json import dumps  # noqa: E402
+from gevent.queue import JoinableQueue  # noqa: E402
+from dateutil import parser  # noqa: E402
+from sqlalchemy import func  # noqa: E402
+from sqlalchemy.dialects.postgresql import insert  # noqa: E402
+from requests.adapters import HTTPAdapter  # noqa: E402
+from urllib3.connection import HTTPConnection  # noqa: E402
+from urllib3.connection import HTTPSConnection  # noqa: E402
+from urllib3.connectionpool import HTTPConnectionPool  # noqa: E402
+from urllib3.connectionpool import HTTPSConnectionPool  # noqa: E402
+
+from psycogreen.gevent import patch_psycopg  # noqa: E402
 patch_psycopg()
 
 
@@ -43,7 +60,23 @@ ENVIRONMENT = os.getenv('ENVIRONMENT', 'acceptance')
 
 WORKERS = 5
 
-GET_QUEUE = JoinableQueue(maxsize=1500)
+# Maximum number of queued page tasks.
+QUEUE_SIZE = 1500
+
+# Number of pages of a date which are fetched in parallel.
+PAGES_AHEAD = int(os.getenv('GOOGLE_PAGES_AHEAD', 2))
+
+# Maximum number of requests per second per host.
+RATE_LIMIT = float(os.getenv('GOOGLE_RATE_LIMIT', 10))
+
+# Connections kept alive to the api, shared by the workers
+# (default: one per worker).
+POOL_SIZE = os.getenv('GOOGLE_POOL_SIZE')
+
+# Seconds a run of the workers may take, and the number of runs
+# to finish the pages left after a timeout.
+TIMEOUT = 3600
+RESUME_ATTEMPTS = 2
 
 STATUS = {
     'done': False
@@ -100,6 +133,78 @@ api_config = {
 AUTH = (api_config['username'], api_config.get('password'))
 
 
+class RateLimiter(object):
+    """
+    Spread requests to a host to at most `rate` per second.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_slot = {}
+
+    def wait(self, host):
+        now = time.time()
+        slot = max(now, self.next_slot.get(host, now))
+        self.next_slot[host] = slot + self.interval
+        gevent.sleep(slot - now)
+
+
+RATE_LIMITER = RateLimiter(RATE_LIMIT)
+
+
+# Seconds spent setting up connections (TCP and TLS) per greenlet.
+CONNECT_TIME = defaultdict(float)
+
+
+class TimedHTTPConnection(HTTPConnection):
+
+    def connect(self):
+        start = time.time()
+        super().connect()
+        CONNECT_TIME[gevent.getcurrent()] += time.time() - start
+
+
+class TimedHTTPSConnection(HTTPSConnection):
+
+    def connect(self):
+        start = time.time()
+        super().connect()
+        CONNECT_TIME[gevent.getcurrent()] += time.time() - start
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """
+    Keep-alive connection pool which records connect time.
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool,
+        }
+
+
+def make_session(pool_size=1):
+    """
+    Session reusing up to pool_size connections between pages.
+    """
+    session = requests.Session()
+    session.auth = AUTH
+    adapter = TimedHTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
 def log_status_code(response, url):
     if response.status_code == 200:
         log.debug(f' OK  {response.status_code}:{url}')
@@ -117,13 +222,17 @@ def log_status_code(response, url):
         raise ValueError('404. NOT FOUND wrong request.')
 
 
-def get_the_json(endpoint, params={'limit': 1000}) -> list:
+def get_the_json(endpoint, params={'limit': 1000}, session=None):
     """
     Get some json of endpoint!
 
-    try prod. fall back on development
+    Returns None when the request failed or did not return 200,
+    so the page can be retried.
+
+    Logs the connect time (0 when a kept-alive connection is reused),
+    the time waiting for the response headers and the time reading
+    the body.
     """
-    json = []
     response = None
     port = api_config['port']
 
@@ -131,27 +240,45 @@ def get_the_json(endpoint, params={'limit': 1000}) -> list:
 
     url = ENDPOINT_URL[endpoint]
     url = url.format(host=host, port=port)
-    async_r = grequests.get(
-        url, params=params, auth=AUTH, timeout=10)
-    gevent.spawn(async_r.send).join()
 
-    response = async_r.response
+    if session is None:
+        session = make_session()
+
+    RATE_LIMITER.wait(urlparse(url).netloc)
+
+    current = gevent.getcurrent()
+    CONNECT_TIME.pop(current, None)
+    start = time.time()
+
+    try:
+        response = session.get(url, params=params, timeout=10)
+    except requests.RequestException:
+        log.exception('RESPONSE NONE %s %s', url, params)
+        return None
 
-    if response is None:
-        log.error('RESPONSE NONE %s %s', url, params)
-        return []
+    # elapsed runs until the response headers are parsed.
+    connect = CONNECT_TIME.pop(current, 0.0)
+    wait = response.elapsed.total_seconds()
+    log.debug(
+        'connect %.2fs wait %.2fs transfer %.2fs %s %s',
+        connect, wait - connect, time.time() - start - wait,
+        url, params)
 
     log_status_code(response, url)
 
-    if response:
-        json = response.json()
+    if response.status_code != 200:
+        return None
 
-    return json
+    return response.json()
 
 
 def add_locations_to_db(endpoint, json: list):
     """
     Given json api response, store data in database
+
+    The locations are copied into a temporary staging table and merged
+    into the endpoint table, skipping (place_id, scraped_at) rows
+    we already have.
     """
 
     if not json:
@@ -159,60 +286,137 @@ def add_locations_to_db(endpoint, json: list):
         return
 
     db_model = ENDPOINT_MODEL[endpoint]
+    tablename = db_model.__table__.name
+
+    log.debug(f"Storing {len(json)} locations")
+
+    rows = io.StringIO()
+    writer = csv.writer(rows)
+    for loc in json:
+        writer.writerow([
+            loc['place_id'],
+            parser.parse(loc['ScrapeTime']).isoformat(),
+            loc['name'],
+            dumps(loc),
+        ])
+    rows.seek(0)
 
     # make new session
     session = models.Session()
+    cursor = session.connection().connection.cursor()
+
+    cursor.execute(f"""
+CREATE TEMPORARY TABLE {tablename}_staging (
+    place_id varchar,
+    scraped_at timestamp,
+    name varchar,
+    data jsonb
+) ON COMMIT DROP
+    """)
+    cursor.copy_expert(
+        f'COPY {tablename}_staging FROM STDIN WITH (FORMAT csv)', rows)
+    cursor.execute(f"""
+INSERT INTO {tablename} (id, place_id, scraped_at, name, data)
+SELECT nextval('grl_seq'), place_id, scraped_at, name, data
+FROM {tablename}_staging
+ON CONFLICT (place_id, scraped_at) DO NOTHING
+    """)
+    inserted = cursor.rowcount
 
-    log.debug(f"Storing {len(json)} locations")
+    session.commit()
 
-    # Store the location json!
-    for loc in json:
+    log.debug(f"Updated {inserted} of {len(json)} locations")
+
+
+def create_unique_index(db_model):
+    """
+    Make sure the (place_id, scraped_at) index used by
+    add_locations_to_db exists.
 
-        place_id = loc['place_id']
-        scraped_at = parser.parse(loc['ScrapeTime'])
+    Tables created before the index was added to the models
+    are deduplicated once and get the index.
+    """
+    session = models.Session()
 
-        gevent.sleep()
+    for index in db_model.__table__.indexes:
+        if not index.unique:
+            continue
 
-        grj = db_model(
-            place_id=place_id,
-            scraped_at=scraped_at,
-            name=loc['name'],
-            data=loc,
-        )
+        exists = session.execute(
+            'SELECT to_regclass(:name)', {'name': index.name}).scalar()
+        if exists:
+            continue
 
-        session.add(grj)
+        log.info('Creating index %s', index.name)
+        if session.query(db_model).first() is not None:
+            delete_duplicates(db_model)
+        index.create(bind=session.get_bind())
 
-    session.commit()
+    session.close()
+
+
+def estimate_count(session, tablename) -> int:
+    """
+    Row count estimate from the planner statistics, without a table scan.
+    """
+    return session.execute(
+        'SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:t)',
+        {'t': tablename}).scalar() or 0
 
-    log.debug(f"Updated {len(json)} locations")
+
+def check_count(db_model):
+    """
+    Make sure we have data.
+    """
+    session = models.Session()
+
+    if session.query(db_model.id).first() is None:
+        raise ValueError('NO DATA RECIEVED WHATSOEVER!')
+
+    log.debug(
+        'Count about %d', estimate_count(session, db_model.__table__.name))
+    session.close()
 
 
 def delete_duplicates(db_model):
     """
     Remove duplacates from table.
+
+    Only rows added since the previous run are checked against
+    older rows, using the (place_id, scraped_at) index.
     """
     # make new session
     session = models.Session()
 
-    if session.query(db_model).count() == 0:
-        raise ValueError('NO DATA RECIEVED WHATSOEVER!')
-
-    log.debug('Count before %d', session.query(db_model).count())
+    check_count(db_model)
 
     tablename = db_model.__table__.name
-    session.execute(f"""
-DELETE FROM {tablename} a USING (
-     SELECT MIN(ctid) AS ctid, place_id, scraped_at
-        FROM {tablename}
-        GROUP BY (scraped_at, place_id) HAVING COUNT(*) > 1
- ) dups
- WHERE a.place_id = dups.place_id
- AND a.scraped_at = dups.scraped_at
- AND a.ctid <> dups.ctid
-    """)
+
+    mark = session.query(models.DedupeMark).filter_by(
+        tablename=tablename).first()
+    if mark is None:
+        mark = models.DedupeMark(tablename=tablename, last_id=0)
+        session.add(mark)
+
+    last_id = session.query(func.max(db_model.id)).scalar()
+
+    log.debug('Checking ids %d - %d', mark.last_id, last_id)
+
+    result = session.execute(f"""
+DELETE FROM {tablename} a USING {tablename} b
+ WHERE a.id > :since AND a.id <= :until
+ AND a.place_id = b.place_id
+ AND a.scraped_at = b.scraped_at
+ AND b.id < a.id
+    """, {'since': mark.last_id, 'until': last_id})
+
+    mark.last_id = last_id
     session.commit()
 
-    log.debug('Count after %d', session.query(db_model).count())
+    log.debug(
+        'Deleted %d duplicates, count about %d',
+        result.rowcount, estimate_count(session, tablename))
+    session.close()
 
 
 def get_previous_days():
@@ -234,44 +438,163 @@ def get_previous_days():
         yield (str(past_date1), str(past_date2))
 
 
-def get_locations(work_id, endpoint, gen_dates):
+def page_params(task):
+    """
+    Request parameters of an (endpoint, date, skip) task.
+    """
+    _endpoint, date, skip = task
+
+    params = {'limit': LIMIT, 'skip': skip}
+
+    if date:
+        day = datetime.datetime.strptime(date, '%Y-%m-%d')
+        params['startDate'] = date
+        params['endDate'] = str((day + datetime.timedelta(days=1)).date())
+
+    return params
+
+
+# Date of the pages of the current endpoints. Not None, so the
+# unique checkpoint index sees pages of these endpoints as equal.
+UNDATED = ''
+
+
+def initial_tasks(endpoint):
     """
-    Get google locations information with 'real-time' data
+    The first PAGES_AHEAD pages of every date to scrape.
     """
-    params = {}
+    if 'current' in endpoint:
+        dates = [UNDATED]
+    else:
+        dates = [date1 for date1, _date2 in get_previous_days()]
+
+    return [
+        (endpoint, date, page * LIMIT)
+        for date in dates
+        for page in range(PAGES_AHEAD)
+    ]
+
 
-    # generate past dates (global)
-    for date1, date2 in gen_dates:
-        # generate limit parameters
+def produce_tasks(queue, tasks):
+    for task in tasks:
+        queue.put(task)
 
-        params['startDate'] = date1
-        params['endDate'] = date2
 
-        do_limit_requests(work_id, endpoint, gen_dates, params=params)
+def load_checkpoints(endpoint) -> dict:
+    """
+    Stored pages of endpoint, {(endpoint, date, skip): rows}
+    """
+    session = models.Session()
+    checkpoints = session.query(models.ScrapeCheckpoint).filter_by(
+        endpoint=endpoint)
+    done = {(c.endpoint, c.start_date, c.skip): c.rows for c in checkpoints}
+    session.close()
+    return done
+
 
-    log.debug(f'Done {work_id}')
+def clear_checkpoints(endpoint):
+    session = models.Session()
+    session.query(models.ScrapeCheckpoint).filter_by(
+        endpoint=endpoint).delete()
+    session.commit()
 
 
-def do_limit_requests(work_id, endpoint, _gen_dates, params={}):
+def save_checkpoint(task, rows):
     """
-    Do batch request of LIMIT each
+    Remember that the page of task is stored.
     """
+    endpoint, date, skip = task
+    checkpoint = insert(models.ScrapeCheckpoint.__table__).values(
+        endpoint=endpoint,
+        start_date=date,
+        skip=skip,
+        rows=rows,
+        done_at=datetime.datetime.now(),
+    )
+    checkpoint = checkpoint.on_conflict_do_update(
+        index_elements=['endpoint', 'start_date', 'skip'],
+        set_={'rows': rows, 'done_at': checkpoint.excluded.done_at},
+    )
+    session = models.Session()
+    session.execute(checkpoint)
+    session.commit()
 
-    params.update({'limit': LIMIT, 'skip': 0})
+
+def consume_tasks(work_id, queue, pending, errors, checkpoints, session):
+    """
+    Fetch and store pages until the queue is done.
+
+    A full page means the date has more pages, so the page
+    PAGES_AHEAD further is added to the queue. Pages in
+    checkpoints are already stored and not fetched again.
+
+    Pages which could not be fetched stay pending and are not
+    checkpointed, so the next attempt or --resume retries them.
+    """
 
     while True:
-        log.debug('%d %s', work_id, params)
+        task = queue.get()
+        endpoint, date, skip = task
+        try:
+            if task in checkpoints:
+                rows = checkpoints[task]
+            else:
+                log.debug('%d %s', work_id, task)
+                json_response = get_the_json(
+                    endpoint, page_params(task), session)
+                if json_response is None:
+                    log.warning('%d fetch failed %s', work_id, task)
+                    continue
+                add_locations_to_db(endpoint, json_response)
+                rows = len(json_response)
+                save_checkpoint(task, rows)
+
+            if rows >= LIMIT:
+                next_task = (endpoint, date, skip + PAGES_AHEAD * LIMIT)
+                pending.add(next_task)
+                queue.put(next_task)
+
+            pending.discard(task)
+        except Exception as exc:
+            log.exception('%d failed %s', work_id, task)
+            errors.append(exc)
+        finally:
+            queue.task_done()
+
+
+def run_tasks(tasks, workers, checkpoints={}):
+    """
+    Run tasks with X workers, but no longer than TIMEOUT.
 
-        json_response = get_the_json(endpoint, params)
-        add_locations_to_db(endpoint, json_response)
+    The workers share one session with GOOGLE_POOL_SIZE
+    connections, by default one per worker.
 
-        if len(json_response) < LIMIT:
-            # We are done with date
-            break
+    Returns the tasks which are not done.
+    """
+    queue = JoinableQueue(maxsize=QUEUE_SIZE)
+    pending = set(tasks)
+    errors = []
+    session = make_session(int(POOL_SIZE or workers))
+
+    producer = gevent.spawn(produce_tasks, queue, tasks)
+    consumers = [
+        gevent.spawn(
+            consume_tasks, i, queue, pending, errors, checkpoints, session)
+        for i in range(workers)
+    ]
+
+    with gevent.Timeout(TIMEOUT, False):
+        # wait untill all tasks are done
+        # but no longer than TIMEOUT
+        producer.join()
+        queue.join()
 
-        params['skip'] = params.get('skip', 0) + LIMIT
+    gevent.killall([producer] + consumers)
 
-    log.debug(f'Done {params}')
+    if errors:
+        raise errors[0]
+
+    return pending
 
 
 def clear_current_table(endpoint):
@@ -285,38 +608,46 @@ def clear_current_table(endpoint):
     session.commit()
 
 
-def run_workers(endpoint, workers=WORKERS, parralleltask=get_locations):
-    """
-    Run X workers processing search tasks
+def run_workers(endpoint, workers=WORKERS, resume=False):
     """
-    jobs = []
+    Run X workers processing (endpoint, date, skip) page tasks
 
+    With resume, pages stored by a previous (failed) run are skipped.
+    """
     # reset job status
     STATUS['done'] = False
 
-    gen_dates = get_previous_days()
+    create_unique_index(ENDPOINT_MODEL[endpoint])
+
+    if resume:
+        checkpoints = load_checkpoints(endpoint)
+        log.info('Resuming, %d pages done', len(checkpoints))
+    else:
+        clear_checkpoints(endpoint)
+        checkpoints = {}
 
     if 'current' in endpoint:
         # get current data
-        clear_current_table(endpoint)
-        parralleltask = do_limit_requests
+        if not resume:
+            clear_current_table(endpoint)
         workers = 1
 
-    for i in range(workers):
-        jobs.append(
-            gevent.spawn(parralleltask, i, endpoint, gen_dates)
-        )
+    tasks = initial_tasks(endpoint)
 
-    with gevent.Timeout(3600, False):
-        # wait untill all tasks are done
-        # but no longer than an hour
-        gevent.joinall(jobs)
+    for _attempt in range(RESUME_ATTEMPTS):
+        tasks = run_tasks(tasks, workers, checkpoints)
+        if not tasks:
+            break
+        # continue with the unfinished and failed pages.
+        log.warning('%d pages left', len(tasks))
 
-    for job in jobs:
-        if not job.successful():
-            raise job.exception
+    if tasks:
+        log.error('Gave up on %d pages', len(tasks))
 
-    delete_duplicates(ENDPOINT_MODEL[endpoint])
+    STATUS['done'] = True
+
+    # add_locations_to_db does not store duplicates.
+    check_count(ENDPOINT_MODEL[endpoint])
 
 
 def main(args):
@@ -334,7 +665,7 @@ def main(args):
         delete_duplicates(ENDPOINT_MODEL[endpoint])
     else:
         # scrape the data!
-        run_workers(endpoint)
+        run_workers(endpoint, resume=args.resume)
 
 
 if __name__ == '__main__':
@@ -355,5 +686,11 @@ if __name__ == '__main__':
         default=False,
         help="Remove duplicates")
 
+    inputparser.add_argument(
+        '--resume',
+        action='store_true',
+        default=False,
+        help="Skip pages stored by a previous run")
+
     args = inputparser.parse_args()
     main(args)
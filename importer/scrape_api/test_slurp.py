@@ -77,3 +77,51 @@ class TestDBWriting(unittest.TestCase):
         slurp_api.run_workers('qa_realtime', workers=1)
         count = session.query(models.GoogleRawLocationsRealtime).count()
         self.assertEqual(count, 1)
+
+    @mock.patch('slurp_api.get_the_json')
+    def test_resume_skips_stored_pages(self, get_json_mock):
+
+        with open(FIX_DIR + '/fixtures/realtime.json') as mockjson:
+            test_json = json.loads(mockjson.read())
+
+        get_json_mock.return_value = test_json
+
+        slurp_api.run_workers('qa_realtime', workers=1)
+        self.assertTrue(get_json_mock.called)
+
+        # every page is stored, nothing left to fetch
+        get_json_mock.reset_mock()
+        slurp_api.run_workers('qa_realtime', workers=1, resume=True)
+        self.assertFalse(get_json_mock.called)
+
+    @mock.patch('slurp_api.get_the_json')
+    def test_resume_retries_failed_pages(self, get_json_mock):
+
+        with open(FIX_DIR + '/fixtures/realtime.json') as mockjson:
+            test_json = json.loads(mockjson.read())
+
+        get_json_mock.return_value = test_json
+        slurp_api.run_workers('qa_realtime', workers=1)
+
+        # failed requests are not stored as done
+        get_json_mock.return_value = None
+        slurp_api.run_workers('qa_realtime', workers=1)
+        self.assertEqual(slurp_api.load_checkpoints('qa_realtime'), {})
+
+        get_json_mock.reset_mock()
+        get_json_mock.return_value = test_json
+        slurp_api.run_workers('qa_realtime', workers=1, resume=True)
+        self.assertTrue(get_json_mock.called)
+
+    def test_undated_checkpoint_is_stored_once(self):
+        slurp_api.clear_checkpoints('qa_realtime/current')
+
+        task = slurp_api.initial_tasks('qa_realtime/current')[0]
+        slurp_api.save_checkpoint(task, 10)
+        slurp_api.save_checkpoint(task, 20)
+
+        count = session.query(models.ScrapeCheckpoint).filter_by(
+            endpoint='qa_realtime/current').count()
+        self.assertEqual(count, 1)
+        self.assertEqual(
+            slurp_api.load_checkpoints('qa_realtime/current'), {task: 20})
@@ -0,0 +1,216 @@
+"""
+Tests of the alpha parser.
+"""
+
+import copy
+import json
+import os
+import re
+import unittest
+
+import pandas as pd
+from sqlalchemy import text
+
+import models
+from parsers import alpha
+
+
+FIX_DIR = os.path.join(os.path.dirname(__file__), 'scrape_api', 'fixtures')
+
+with open(os.path.join(FIX_DIR, 'expected.json')) as fixture:
+    LOCATION = json.load(fixture)[0]
+
+
+def make_raw():
+    """Raw rows of the quantillion table, with 12am/12pm and no intervals."""
+    night = copy.deepcopy(LOCATION)
+    night['Expected'] = [
+        {'ExpectedValue': 0.1, 'TimeInterval': '12am-1am'},
+        {'ExpectedValue': 0.2, 'TimeInterval': '1am-2am'},
+        {'ExpectedValue': 0.3, 'TimeInterval': '11pm-12am'},
+    ]
+    night['types'] = ['park', 'point_of_interest']
+
+    closed = copy.deepcopy(LOCATION)
+    closed['Expected'] = []
+
+    return pd.DataFrame({
+        'id': [4, 7, 9],
+        'place_id': ['a', 'b', 'c'],
+        'name': ["Het Smikkelhoekje", "Sarphatipark", "Dicht"],
+        'scraped_at': pd.to_datetime(
+            ['2018-02-21 02:16', '2018-02-24 10:00', '2018-02-25 10:00']),
+        'data': [LOCATION, night, closed],
+    })
+
+
+def old_flatten_alpha(raw, first_id=0):
+    """
+    The former row by row parser (parse_alpha_item), without the sql.
+
+    Tags are evaluated as a list and 12am is hour 0, the two fixes
+    made in flatten_alpha.
+    """
+    rows = []
+    id_counter = first_id
+    for i in range(len(raw)):
+        data = raw.data[i]
+        main_category, main_category_weight = alpha.evaluate_tags(
+            data['types'])
+        for interval in data['Expected']:
+            hour = interval['TimeInterval'][0:2]
+            hour = int(re.sub("[^0-9]", "", hour))
+            ampm = interval['TimeInterval'][1:4]
+            ampm = re.sub('[^a-zA-Z]+', '', ampm)
+            if hour == 12:
+                hour = 0
+            if ampm == 'pm':
+                hour += 12
+            rows.append({
+                'id': id_counter,
+                'raw_id': raw.id[i],
+                'place_id': raw.place_id[i],
+                'name': raw.name[i],
+                'url': data['url'],
+                'weekday': raw.scraped_at[i].weekday(),
+                'hour': hour,
+                'expected': interval['ExpectedValue'],
+                'lat': data['location']['coordinates'][1],
+                'lon': data['location']['coordinates'][0],
+                'address': data['formatted_address'],
+                'location_type': data['location']['type'],
+                'main_category': main_category,
+                'main_category_weight': main_category_weight,
+                'visit_duration': data['VisitDuration'],
+                'types': str(data['types']),
+                'category': data['Category'],
+            })
+            id_counter += 1
+    return pd.DataFrame(rows, columns=alpha.ALPHA_COLUMNS)
+
+
+class TestFlattenAlpha(unittest.TestCase):
+
+    def test_same_as_row_by_row(self):
+        raw = make_raw()
+        expected = old_flatten_alpha(raw, first_id=10)
+        df = alpha.flatten_alpha(raw, first_id=10)
+
+        self.assertEqual(len(df), 12 + 3)
+        pd.testing.assert_frame_equal(df, expected, check_dtype=False)
+
+    def test_12am_and_12pm(self):
+        df = alpha.flatten_alpha(make_raw())
+        night = df[df.place_id == 'b']
+
+        self.assertEqual(list(night.hour), [0, 1, 23])
+        self.assertIn(12, list(df[df.place_id == 'a'].hour))
+
+    def test_no_intervals(self):
+        raw = make_raw().iloc[[2]].reset_index(drop=True)
+        df = alpha.flatten_alpha(raw)
+
+        self.assertTrue(df.empty)
+        self.assertEqual(list(df.columns), alpha.ALPHA_COLUMNS)
+
+
+class TestTags(unittest.TestCase):
+
+    intervals = [
+        '12am-1am', '1am-2am', '9am-10am', '11am-12pm',
+        '12pm-1pm', '1pm-2pm', '11pm-12am']
+
+    def test_parse_hours(self):
+        hours = alpha.parse_hours(pd.Series(self.intervals))
+        self.assertEqual(list(hours), [0, 1, 9, 11, 12, 13, 23])
+
+    def test_evaluate_tag_lists(self):
+        tag_lists = pd.Series([
+            ['restaurant', 'food'],
+            ['bar', 'park', 'point_of_interest'],
+            ['point_of_interest'],
+            [],
+            ['restaurant', 'food'],
+        ])
+        categories, weights = alpha.evaluate_tag_lists(tag_lists)
+
+        for tags, category, weight in zip(tag_lists, categories, weights):
+            self.assertEqual(
+                (category, weight), alpha.evaluate_tags(tags))
+
+
+class TestIncrementalRun(unittest.TestCase):
+    """
+    Import raw rows twice into the test database.
+    """
+
+    config = {
+        'SOURCE_TABLE': 'alpha_raw_test',
+        'TABLE_NAME': 'alpha_test',
+        'INCREMENTAL': 'YES',
+    }
+
+    @classmethod
+    def setUpClass(cls):
+        models.create_db()
+        cls.engine = models.make_engine(section='test')
+        cls.conn = cls.engine.connect()
+        cls.conn.execute('CREATE EXTENSION IF NOT EXISTS postgis')
+        cls.conn.execute("""
+        DROP TABLE IF EXISTS alpha_raw_test;
+        CREATE TABLE alpha_raw_test (
+            id INTEGER, place_id VARCHAR, name VARCHAR,
+            scraped_at TIMESTAMP, data JSONB);
+        """)
+        cls.conn.execute(alpha.drop_alpha_table('alpha_test'))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.conn.close()
+        cls.engine.dispose()
+        models.drop_db()
+
+    def add_raw(self, raw):
+        for row in raw.itertuples():
+            insert = text("""
+            INSERT INTO alpha_raw_test
+            VALUES (:id, :place_id, :name, :scraped_at, CAST(:data AS jsonb))
+            """)
+            self.conn.execute(
+                insert, id=row.id, place_id=row.place_id, name=row.name,
+                scraped_at=row.scraped_at.to_pydatetime(),
+                data=json.dumps(row.data))
+
+    def select(self, sql):
+        return self.conn.execute(sql).fetchall()
+
+    def test_run_twice(self):
+        raw = make_raw()
+        self.add_raw(raw.iloc[:2])
+        alpha.run(self.conn, **self.config)
+
+        self.assertEqual(
+            self.select('SELECT raw_id, count(*), min(id), max(id) '
+                        'FROM alpha_test GROUP BY raw_id ORDER BY raw_id'),
+            [(4, 12, 0, 11), (7, 3, 12, 14)])
+        self.assertEqual(
+            self.select('SELECT after_raw_id FROM alpha_test_geometry_mark'),
+            [(0,)])
+
+        # add_geometries of the first import removes the mark.
+        self.conn.execute('DELETE FROM alpha_test_geometry_mark')
+
+        # Only the raw row above the high-water mark is added,
+        # with ids after the last id.
+        later = raw.iloc[[1]].copy()
+        later['id'] = 9
+        self.add_raw(later)
+        alpha.run(self.conn, **self.config)
+
+        self.assertEqual(
+            self.select('SELECT raw_id, count(*), min(id), max(id) '
+                        'FROM alpha_test GROUP BY raw_id ORDER BY raw_id'),
+            [(4, 12, 0, 11), (7, 3, 12, 14), (9, 3, 15, 17)])
+        self.assertEqual(
+            self.select('SELECT after_raw_id FROM alpha_test_geometry_mark'),
+            [(7,)])
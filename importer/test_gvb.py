@@ -0,0 +1,45 @@
+"""
+Tests of the gvb parser.
+"""
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from parsers import gvb
+
+
+class TestGvb(unittest.TestCase):
+
+    def test_fix_times(self):
+        # 24:00 - 27:59 belong to the service day before.
+        hour, day = gvb.fix_times(
+            np.array([23, 24, 25, 27, 0, 3]),
+            np.array([1, 1, 3, 7, 2, 5]))
+
+        self.assertEqual(list(hour), [23, 0, 1, 3, 0, 3])
+        self.assertEqual(list(day), [1, 7, 2, 6, 2, 5])
+
+    def test_read_ritten(self):
+        # Rows of the same halte and time are spread over the chunks.
+        rows = [
+            'ma,07:00 - 07:59,1,A,2,3',
+            'ma,07:00 - 07:59,1,A,2,4',
+            'di,25:00 - 25:59,1,A,2,1',
+            'ma,07:00 - 07:59,1,A,2,5',
+            'ma,07:00 - 07:59,2,B,1,2',
+        ]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'ritten.csv')
+            with open(path, 'w') as ritten_file:
+                ritten_file.write('kop\nkop\n' + '\n'.join(rows) + '\n')
+            ritten = gvb.read_ritten(path, chunksize=2)
+
+        self.assertEqual(
+            ritten.values.tolist(), [
+                ['di', '25:00 - 25:59', 1, 2, 1],
+                ['ma', '07:00 - 07:59', 1, 2, 12],
+                ['ma', '07:00 - 07:59', 2, 1, 2],
+            ])
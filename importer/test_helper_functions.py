@@ -0,0 +1,73 @@
+"""
+Tests of the parsed source cache.
+"""
+
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+
+from parsers.helper_functions import PARQUET_CACHE_DIR
+from parsers.helper_functions import cached_parse
+
+
+class TestCachedParse(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.data_root = self.tmp_dir.name
+        self.path = os.path.join(self.data_root, 'source.csv')
+        self.write('a,b\n1,x\n2,y\n')
+        self.parsed = 0
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, content):
+        with open(self.path, 'w') as source:
+            source.write(content)
+
+    def parse(self):
+        self.parsed += 1
+        # concat gives a non default index
+        df = pd.read_csv(self.path)
+        return pd.concat([df, df])
+
+    def cached(self, **config):
+        return cached_parse(
+            self.data_root, 'source', [self.path], self.parse,
+            dict({'TABLE_NAME': 'source'}, **config),
+            columns=['a'], dtypes={'a': 'int64'})
+
+    def test_cache_hit(self):
+        parsed = self.cached()
+        cached = self.cached()
+
+        self.assertEqual(self.parsed, 1)
+        pd.testing.assert_frame_equal(parsed, cached)
+        self.assertEqual(list(cached.columns), ['a'])
+        self.assertEqual(list(cached.index), [0, 1, 2, 3])
+
+    def test_changed_file(self):
+        self.cached()
+        self.write('a,b\n3,z\n')
+        df = self.cached()
+
+        self.assertEqual(self.parsed, 2)
+        self.assertEqual(list(df.a), [3, 3])
+        # the result of the old file is removed
+        cache_dir = os.path.join(self.data_root, PARQUET_CACHE_DIR)
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+    def test_changed_config(self):
+        self.cached()
+        self.cached(TABLE_NAME='other')
+
+        self.assertEqual(self.parsed, 2)
+
+    def test_ignored_config(self):
+        self.cached(WORKERS='2', DEPENDS='gebieden')
+        self.cached(WORKERS='8')
+
+        self.assertEqual(self.parsed, 1)
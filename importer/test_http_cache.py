@@ -0,0 +1,92 @@
+"""
+Tests of the conditional fetching of the realtime feeds.
+"""
+
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from http_cache import ConditionalFetcher
+from http_cache import parse_json
+from http_cache import parse_ndw_velocity
+
+
+URL = 'http://example.com/feed.json'
+
+FEED = {'features': [
+    {'properties': {'Type': 'H', 'Velocity': 100}},
+    {'properties': {'Type': 'O', 'Velocity': 30}},
+    {'properties': {'Type': 'O', 'Velocity': 50}},
+    {'properties': {'Type': 'O'}},
+]}
+
+
+def make_response(status_code, data=None, headers=None):
+    response = mock.MagicMock(status_code=status_code, headers=headers or {})
+    response.json.return_value = data
+    response.raw = io.BytesIO(json.dumps(data).encode())
+    return response
+
+
+class TestConditionalFetcher(unittest.TestCase):
+
+    def test_not_modified_reuses_data(self):
+        session = mock.Mock()
+        fetcher = ConditionalFetcher(session)
+
+        last_modified = 'Fri, 01 Jun 2018 12:00:00 GMT'
+        session.get.return_value = make_response(
+            200, FEED, {'Last-Modified': last_modified})
+        self.assertEqual(fetcher.get(URL), FEED)
+
+        session.get.return_value = make_response(304)
+        self.assertEqual(fetcher.get(URL), FEED)
+
+        headers = session.get.call_args[1]['headers']
+        self.assertEqual(headers['If-Modified-Since'], last_modified)
+        self.assertNotIn('If-None-Match', headers)
+
+    def test_error_response(self):
+        session = mock.Mock()
+        fetcher = ConditionalFetcher(session)
+
+        response = make_response(500)
+        response.raise_for_status.side_effect = Exception('500')
+        session.get.return_value = response
+
+        with self.assertRaises(Exception):
+            fetcher.get(URL)
+        self.assertEqual(fetcher.entries, {})
+
+    def test_parse_ndw_velocity(self):
+        session = mock.Mock()
+        fetcher = ConditionalFetcher(session)
+
+        session.get.return_value = make_response(200, FEED)
+        self.assertEqual(
+            fetcher.get(URL, parse=parse_ndw_velocity, stream=True), {
+                'H': {'sum': 100, 'count': 1},
+                'O': {'sum': 80, 'count': 2},
+            })
+        self.assertTrue(session.get.call_args[1]['stream'])
+
+    def test_cache_file(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        cache_file = os.path.join(cache_dir.name, 'http_cache.json')
+
+        session = mock.Mock()
+        session.get.return_value = make_response(200, FEED, {'ETag': '"v1"'})
+        ConditionalFetcher(session, cache_file=cache_file).get(URL)
+
+        # A restarted fetcher sends the stored validator.
+        session.get.return_value = make_response(304)
+        fetcher = ConditionalFetcher(session, cache_file=cache_file)
+        self.assertEqual(fetcher.get(URL, parse=parse_json), FEED)
+
+        headers = session.get.call_args[1]['headers']
+        self.assertEqual(headers['If-None-Match'], '"v1"')
+        self.assertFalse(os.path.exists(f'{cache_file}.tmp'))
@@ -0,0 +1,62 @@
+"""
+Tests of the import step scheduling.
+"""
+
+import unittest
+from unittest import mock
+
+import main
+
+
+CONFIG = {
+    'gebieden': {'ENABLE': 'YES'},
+    'hotspots': {'ENABLE': 'YES', 'DEPENDS': 'gebieden'},
+    'alpha': {'ENABLE': 'YES', 'DEPENDS': 'gebieden hotspots'},
+    'parkeren': {'ENABLE': 'YES', 'DEPENDS': 'hotspots', 'WORKERS': '8'},
+}
+
+
+class TestSteps(unittest.TestCase):
+
+    def test_build_steps(self):
+        steps = main.build_steps(CONFIG)
+
+        self.assertEqual(len(steps), 8)
+        self.assertEqual(steps[('alpha', 'run')], set())
+        self.assertEqual(steps[('alpha', 'add_geometries')], {
+            ('alpha', 'run'),
+            ('gebieden', 'add_geometries'),
+            ('hotspots', 'add_geometries'),
+        })
+
+    def test_dependencies_not_enabled(self):
+        steps = main.build_steps({'parkeren': CONFIG['parkeren']})
+        self.assertEqual(
+            steps[('parkeren', 'add_geometries')], {('parkeren', 'run')})
+
+    @mock.patch('main.run_step')
+    def test_step_order(self, run_step_mock):
+        main.parse_datasets(CONFIG, 'data', workers=1)
+
+        order = [call[0][:2] for call in run_step_mock.call_args_list]
+        self.assertEqual(len(order), 8)
+        for step, before in main.build_steps(CONFIG).items():
+            for other in before:
+                self.assertLess(order.index(other), order.index(step))
+
+    @mock.patch('main.run_step')
+    def test_circular_depends(self, run_step_mock):
+        config = {
+            'alpha': {'DEPENDS': 'hotspots'},
+            'hotspots': {'DEPENDS': 'alpha'},
+        }
+        with self.assertRaises(ValueError):
+            main.parse_datasets(config, 'data', workers=1)
+
+    def test_limit_workers(self):
+        self.assertEqual(
+            main.limit_workers(CONFIG['parkeren'], 3)['WORKERS'], '3')
+        self.assertEqual(
+            main.limit_workers(CONFIG['parkeren'], 16)['WORKERS'], '8')
+        self.assertEqual(
+            main.limit_workers(CONFIG['gebieden'], 2)['WORKERS'], '2')
@@ -0,0 +1,77 @@
+"""
+Tests of the parkeren week partitions.
+"""
+
+import unittest
+
+from sqlalchemy.exc import IntegrityError
+
+import models
+from parsers import parkeren
+
+
+class TestFilesPerWeek(unittest.TestCase):
+
+    def test_files_per_week(self):
+        files = [
+            '2018_w16_Tu_09_12_BETAALDP.csv',
+            '2018_w16_Ma_00_08_BETAALDP.csv',
+            '2018_w17_Su_18_23_BETAALDP.csv',
+            '2017_w52_Fr_12_17_BETAALDP.csv',
+            # days ranges and other files are left out
+            '2018_w16_Mo_00_08_BETAALDP.csv',
+            '2018_w16_Ma_Fr_09_12_BETAALDP.csv',
+            '2018_w16_Sa_Su_09_12_BETAALDP.csv',
+            '2018_w16_Tu_09_12_VERGUNNING.csv',
+            'README.txt',
+        ]
+
+        self.assertEqual(parkeren.files_per_week(files), {
+            201752: ['2017_w52_Fr_12_17_BETAALDP.csv'],
+            201816: [
+                '2018_w16_Ma_00_08_BETAALDP.csv',
+                '2018_w16_Tu_09_12_BETAALDP.csv',
+            ],
+            201817: ['2018_w17_Su_18_23_BETAALDP.csv'],
+        })
+
+
+class TestWeekPartition(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        models.create_db()
+        cls.engine = models.make_engine(section='test')
+        cls.conn = cls.engine.connect()
+        cls.conn.execute("""
+        DROP TABLE IF EXISTS parkeren_test CASCADE;
+        CREATE TABLE parkeren_test (
+            vollcode VARCHAR, weekday INT, hour INT, week INT);
+        """)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.conn.execute('DROP TABLE parkeren_test CASCADE')
+        cls.conn.close()
+        cls.engine.dispose()
+        models.drop_db()
+
+    def test_check_week(self):
+        partition = parkeren.create_week_partition(
+            self.conn, 'parkeren_test', 201816)
+        self.assertEqual(partition, 'parkeren_test_201816')
+
+        insert = f"""
+        INSERT INTO "{partition}" (vollcode, weekday, hour, week)
+        VALUES ('A00', 0, 9, %s)
+        """
+        self.conn.execute(insert, (201816,))
+        with self.assertRaises(IntegrityError):
+            self.conn.execute(insert, (201817,))
+
+        # the parent reads the rows of its partitions
+        self.assertEqual(
+            self.conn.execute(
+                'SELECT week, count(*) FROM parkeren_test GROUP BY week'
+            ).fetchall(),
+            [(201816, 1)])
@@ -0,0 +1,161 @@
+"""
+Tests of the realtime crowdedness score.
+"""
+
+import datetime
+import json
+import os
+import signal
+import threading
+import unittest
+from http.server import HTTPServer
+from unittest import mock
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+from pytest import approx
+
+import realtime
+
+
+class TestCombineScores(unittest.TestCase):
+
+    def test_missing_source(self):
+        scores = {
+            'ov_fiets': 0.2,
+            'ndw': None,
+            'pr': 0.4,
+            'knmi': 0.6,
+            'weer': 0.8,
+        }
+        weights = realtime.source_weights(scores, hour=12)
+
+        self.assertEqual(weights['ndw'], 0)
+        self.assertEqual(weights['pr'], 25)
+
+        # ov_fiets 10, pr 25, knmi 15, weer 15
+        expected = (10 * 0.2 + 25 * 0.4 + 15 * 0.6 + 15 * 0.8) / 65
+        self.assertEqual(
+            realtime.combine_scores(scores, weights), approx(expected))
+
+    def test_night_weights(self):
+        scores = dict.fromkeys(realtime.SOURCES, 0.5)
+        weights = realtime.source_weights(scores, hour=4)
+
+        self.assertEqual(weights['knmi'], approx(15 * 0.15))
+        self.assertEqual(realtime.combine_scores(scores, weights), approx(0.5))
+
+
+def make_row(minute):
+    return {
+        'scraped_at': datetime.datetime(2018, 6, 1, 12, minute),
+        'combined_crowdedness_score': 0.5,
+    }
+
+
+class TestRowWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = mock.Mock()
+        self.conn = self.engine.connect.return_value
+
+    def inserted_rows(self, call):
+        statement = call[0][0]
+        params = statement.compile().params
+        return len([key for key in params if key.startswith('scraped_at')])
+
+    def test_flush_on_batch_size(self):
+        writer = realtime.RowWriter(self.engine, batch_size=3)
+        writer.add(make_row(0))
+        writer.add(make_row(1))
+        self.conn.execute.assert_not_called()
+
+        writer.add(make_row(2))
+        self.assertEqual(self.conn.execute.call_count, 1)
+        self.assertEqual(self.inserted_rows(self.conn.execute.call_args), 3)
+        self.assertEqual(writer.rows, [])
+
+        # The connection is reused for the next batch.
+        for minute in range(3, 6):
+            writer.add(make_row(minute))
+        self.assertEqual(self.conn.execute.call_count, 2)
+        self.engine.connect.assert_called_once_with()
+
+    def test_failed_flush_keeps_rows(self):
+        self.conn.execute.side_effect = [Exception('gone'), None]
+        writer = realtime.RowWriter(self.engine, batch_size=1)
+
+        with self.assertRaises(Exception):
+            writer.add(make_row(0))
+        self.assertEqual(len(writer.rows), 1)
+        self.conn.close.assert_called_once_with()
+
+        writer.close()
+        self.assertEqual(writer.rows, [])
+        self.assertEqual(self.engine.connect.call_count, 2)
+
+    def test_flush_on_sigterm(self):
+        engine = mock.Mock()
+        conn = engine.connect.return_value
+
+        def tick(writer):
+            writer.add(make_row(0))
+            os.kill(os.getpid(), signal.SIGTERM)
+
+        handler = signal.getsignal(signal.SIGTERM)
+        self.addCleanup(signal.signal, signal.SIGTERM, handler)
+
+        with mock.patch.object(realtime, 'get_conn', return_value=engine), \
+                mock.patch.object(realtime, 'tick', side_effect=tick):
+            with self.assertRaises(SystemExit):
+                realtime.run_daemon(interval=60, batch_size=10)
+
+        self.assertEqual(conn.execute.call_count, 1)
+        self.assertEqual(self.inserted_rows(conn.execute.call_args), 1)
+        conn.close.assert_called_once_with()
+
+
+class TestHealth(unittest.TestCase):
+
+    def setUp(self):
+        realtime.HealthHandler.interval = 60
+        self.server = HTTPServer(('localhost', 0), realtime.HealthHandler)
+        self.addCleanup(self.server.server_close)
+        self.url = 'http://localhost:%d/' % self.server.server_port
+
+        patcher = mock.patch.object(realtime, 'LATEST', {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get(self):
+        # Handle a single request in a background thread.
+        thread = threading.Thread(target=self.server.handle_request)
+        thread.start()
+        try:
+            response = urlopen(self.url, timeout=5)
+        except HTTPError as error:
+            response = error
+        thread.join()
+        return response.getcode(), json.loads(response.read().decode())
+
+    def test_no_score_yet(self):
+        status, body = self.get()
+        self.assertEqual(status, 503)
+        self.assertFalse(body['healthy'])
+
+    def test_recent_score(self):
+        realtime.LATEST['scraped_at'] = datetime.datetime.now()
+        realtime.LATEST['combined_crowdedness_score'] = 0.5
+
+        status, body = self.get()
+        self.assertEqual(status, 200)
+        self.assertTrue(body['healthy'])
+        self.assertEqual(body['latest']['combined_crowdedness_score'], 0.5)
+
+    def test_stale_score(self):
+        realtime.LATEST['scraped_at'] = (
+            datetime.datetime.now() - datetime.timedelta(minutes=5))
+
+        status, body = self.get()
+        self.assertEqual(status, 503)
+        self.assertGreater(body['age'], 120)